@@ -1,116 +1,391 @@
 # coding=utf-8
 import os
-import csv
-from time import sleep
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from time import time
 
 import requests as req
 import xml.etree.ElementTree as ET
 
-from ruamel import yaml
+import metrics
+from analytics_store import export
+from api_store import DATABASE_NAME, ApiStore
+from collection_stream import CollectionWriter, iter_items, read_root_attributes
+from game_store import Game, write_snapshot
+from http_client import TokenBucket, get, get_session, meta_has_validators, meta_is_fresh, write_atomic
+from settings import config
 
-config = yaml.safe_load(open('config.yaml', 'r', encoding='utf-8'))
+# Version of the manifest, older manifests are ignored and the collection is written again from the cache
+MANIFEST_VERSION = 2
 
+rate_limiter = None
+store = None
 
-def load_data(url, file_name):
+
+def api_url(path):
+    """
+    Build an url for the BGG XML API
+
+    :param path: path below the api root, e.g. boardgame/13
+    """
+    return f"{config['fetch'].get('api_url', 'https://boardgamegeek.com/xmlapi').rstrip('/')}/{path}"
+
+
+def get_rate_limiter():
+    """
+    Get the rate limiter shared by all workers, it is replaced when the configured rate changes
+    """
+    global rate_limiter
+    rate = config['fetch'].get('requests_per_second', 2)
+    burst = config['fetch'].get('burst', 1)
+    if rate_limiter is None or (rate_limiter.rate, rate_limiter.capacity) != (rate, burst):
+        rate_limiter = TokenBucket(rate, burst)
+    return rate_limiter
+
+
+def request_options():
+    """
+    Options for requests to the API, shared by all workers
+    """
+    return {
+        'limiter': get_rate_limiter(),
+        'max_retries': config['fetch'].get('max_retries', 8),
+        'retry_backoff': config['fetch'].get('retry_backoff', 2),
+    }
+
+
+def get_store():
+    """
+    Get the store of cached API responses shared by all workers, it is replaced when the cache folder changes
+    """
+    global store
+    api_cache_path = os.path.join(config['general']['cache_directory'], config['general']['api_cache_directory'])
+    path = os.path.join(api_cache_path, DATABASE_NAME)
+    if store is None or store.path != path:
+        os.makedirs(api_cache_path, exist_ok=True)
+        store = ApiStore(path)
+    return store
+
+
+def load_data(url, file_name, ttl_days=None):
     """
     Load data either from web or cache if already present
     :param url: url to load
-    :param file_name: name of cached file
+    :param file_name: name of the cached response
+    :param ttl_days: time to live of the cached response, defaults to the configured api_cache_ttl_days
     :return: soup to parse
     """
-    if not os.path.exists(config['general']['cache_directory']):
-        os.makedirs(config['general']['cache_directory'])
-    api_cache_path = os.path.join(config['general']['cache_directory'], config['general']['api_cache_directory'])
-    if not os.path.exists(api_cache_path):
-        os.makedirs(api_cache_path)
-    collection_file = os.path.join(api_cache_path, file_name)
-    if not os.path.exists(collection_file):
-        print(f'Reading {file_name} page from web')
-        response = req.get(url)
-        # Check if response has yielded any game items or is in preparation state
-        while response.text.find('Your request for this collection has been accepted and will be processed') > 0:
-            print(f'Collection not ready yet, waiting 60 seconds')
-            sleep(60)
-            print(f'Reading {file_name} page from web')
-            response = req.get(url)
-        with open(collection_file, 'w', encoding='utf-8') as fp:
-            fp.write(response.text)
-            print(f'{file_name} saved to cache folder')
+    if ttl_days is None:
+        ttl_days = config['general'].get('api_cache_ttl_days')
+    if get_store().fetch(url, file_name, file_name, ttl_days, **request_options()):
+        print(f'{file_name} saved to cache')
     else:
         print(f'Reading {file_name} from cache')
 
-    return ET.parse(collection_file)
+    body = get_store().get(file_name)
+    with metrics.timer('fetch.parse_xml'):
+        return ET.ElementTree(ET.fromstring(body))
 
 
-def get_collection():
+def fetch_batch(game_ids):
     """
-    Get the collection and convert to json
+    Fetch several games with one request and store the response split into one entry per game
+    If the batch fails it is split in halves which are fetched separately
+
+    :param game_ids: ids of the games to fetch
+    """
+    batch_name = f'boardgame batch {game_ids[0]}..{game_ids[-1]} ({len(game_ids)} games)'
+    try:
+        response = get(api_url(f'boardgame/{",".join(game_ids)}?stats=1'), batch_name, **request_options())
+        with metrics.timer('fetch.parse_xml'):
+            boardgames = {boardgame.get('objectid'): boardgame for boardgame in ET.fromstring(response.content)}
+        missing = [game_id for game_id in game_ids if game_id not in boardgames]
+        if missing:
+            raise ValueError(f'response is missing games {", ".join(missing)}')
+    except (RuntimeError, ValueError, ET.ParseError, req.RequestException) as e:
+        if len(game_ids) == 1:
+            raise
+        metrics.count('fetch.batch_split')
+        print(f'Failed to fetch {batch_name}: {e}, retrying in smaller batches')
+        middle = len(game_ids) // 2
+        fetch_batch(game_ids[:middle])
+        fetch_batch(game_ids[middle:])
+        return
+    metrics.count('fetch.batch')
+
+    entries = []
+    fetched_at = time()
+    for game_id in game_ids:
+        single = ET.Element('boardgames')
+        single.append(boardgames[game_id])
+        # Batched responses have no validators of their own, they are fetched again once expired
+        entries.append((f'{game_id}.xml', ET.tostring(single, encoding='UTF-8'), fetched_at, None, None))
+    get_store().put_many(entries)
+
+
+def load_games(game_ids):
+    """
+    Load the data of all games
+    Games missing in the cache are fetched in batches by a bounded pool of workers
+    Stale games are revalidated one by one if the server provided validators, otherwise fetched in batches
+    The games are read from the store in the order of the given ids with a single query, only a small window
+    of them is kept in memory
+
+    :param game_ids: ids of the games to load
+    :return: generator of the boardgame elements
+    """
+    ttl_days = config['general'].get('api_cache_ttl_days')
+    workers = config['fetch'].get('workers', 4)
+    with metrics.timer('fetch.cache_lookup'):
+        meta = get_store().meta_many(f'{game_id}.xml' for game_id in game_ids)
+    stale = [game_id for game_id in game_ids if not meta_is_fresh(meta.get(f'{game_id}.xml'), ttl_days)]
+    uncached = [game_id for game_id in stale if not meta_has_validators(meta.get(f'{game_id}.xml'))]
+    revalidate = [game_id for game_id in stale if meta_has_validators(meta.get(f'{game_id}.xml'))]
+    batch_size = max(1, config['fetch'].get('batch_size', 20))
+    batches = [uncached[i:i + batch_size] for i in range(0, len(uncached), batch_size)]
+    if batches:
+        print(f'Fetching {len(uncached)} games in {len(batches)} batches')
+        with metrics.timer('fetch.batches'), ThreadPoolExecutor(max_workers=workers) as executor:
+            # Consume the results to surface errors of the workers
+            list(executor.map(fetch_batch, batches))
+
+    def revalidate_game(game_id):
+        get_store().fetch(api_url(f'boardgame/{game_id}?stats=1'), f'{game_id}.xml', f'{game_id}.xml', ttl_days,
+                          **request_options())
+
+    if revalidate:
+        print(f'Revalidating {len(revalidate)} games')
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(revalidate_game, revalidate))
+
+    for key, body in get_store().iter_bodies(f'{game_id}.xml' for game_id in game_ids):
+        if body is None:
+            raise RuntimeError(f'{key} is missing in the cache')
+        with metrics.timer('fetch.parse_xml'):
+            yield ET.fromstring(body).find('boardgame')
+
+
+def merge_games(games):
+    """
+    Append the boardgame data to each collection item
+    Items are yielded as soon as their data is loaded, the boardgame data should be removed once written
+
+    :param games: collection items to merge
+    :return: generator of the merged items
+    """
+    for game, boardgame in zip(games, load_games([game.get('objectid') for game in games])):
+        game.append(boardgame)
+        yield game
+
+
+def item_key(game):
+    """
+    Key of a collection item, the collection lists a game once per owned copy
+
+    :param game: collection item as returned by the collection API
+    """
+    return game.get('collid') or game.get('objectid')
+
+
+def manifest_entry(game):
+    """
+    Describe the state of a collection item for the incremental fetch
+    The user digest covers the fields the owner edits, like plays, rating and status,
+    the digest covers all fields including community data like numowned, which changes daily
+
+    :param game: collection item as returned by the collection API
     """
+    status = game.find('status')
+    rating = game.find('./stats/rating')
+    user_fields = [game.findtext('name'), game.findtext('numplays'), game.findtext('comment'),
+                   rating.get('value') if rating is not None else None,
+                   sorted(status.attrib.items()) if status is not None else None]
+    # Ignore the whitespace following the item, it depends on the position in the listing
+    tail, game.tail = game.tail, None
+    digest = hashlib.sha1(ET.tostring(game, encoding='UTF-8')).hexdigest()
+    game.tail = tail
+    return {
+        'lastmodified': status.get('lastmodified') if status is not None else None,
+        'user_digest': hashlib.sha1(json.dumps(user_fields).encode('utf-8')).hexdigest(),
+        'digest': digest,
+    }
 
-    # Find table containing collection
+
+def output_paths():
+    """
+    Paths of the merged XML, the CSV and the manifest of the last fetch
+    """
+    collection_file_key = config['general']['collection_file_key']
+    cache_directory = config['general']['cache_directory']
+    return (os.path.join(cache_directory, f'{collection_file_key}.xml'),
+            os.path.join(cache_directory, f'{collection_file_key}.csv'),
+            os.path.join(cache_directory, f'{collection_file_key}.manifest.json'))
+
+
+def write_analytics(records):
+    """
+    Write the database and the CSV file of the merged games
+
+    :param records: parsed games in the order of the collection
+    """
+    _, csv_file_path, _ = output_paths()
+    export(records, database_path(), csv_file_path)
+
+
+def write_manifest(manifest):
+    """
+    Store the manifest entries of the fetched games
+
+    :param manifest: manifest entries by item key
+    """
+    write_atomic(output_paths()[2],
+                 json.dumps({'version': MANIFEST_VERSION, 'games': manifest}, indent=1).encode('utf-8'))
+
+
+def snapshot_path():
+    """
+    Path of the binary snapshot of the parsed games, stored next to the merged XML
+    """
     collection_file_key = config['general']['collection_file_key']
-    url = f'https://boardgamegeek.com/xmlapi/collection/{config["fetch"]["user"]}?own=1'
-    collection = load_data(url, file_name=f'{collection_file_key}.xml')
+    return os.path.join(config['general']['cache_directory'], f'{collection_file_key}.snapshot')
 
-    print(f'Parsed {len(collection.getroot().findall("item"))} items, writing JSON file')
-    csv_rows = []
 
+def database_path():
+    """
+    Path of the database of the games for analysis, stored next to the merged XML
+    """
+    collection_file_key = config['general']['collection_file_key']
+    return os.path.join(config['general']['cache_directory'], f'{collection_file_key}.sqlite')
+
+
+def write_merged(writer, game, records):
+    """
+    Write a merged item and release its boardgame data
+
+    :param writer: the CollectionWriter of the merged XML
+    :param game: collection item with the boardgame data appended
+    :param records: list the parsed game record is appended to
+    """
+    with metrics.timer('fetch.write_merged'):
+        writer.write(game)
+        records.append(Game.from_item(game))
+        game.remove(game.find('boardgame'))
+    metrics.count('fetch.games')
+
+
+def load_manifest():
+    """
+    Load the manifest of the last fetch
+    :return: manifest entries by item key, None if the last outputs are not complete or of an older version
+    """
+    if not all(os.path.exists(path) for path in output_paths()):
+        return None
+    with open(output_paths()[2], 'r', encoding='utf-8') as fp:
+        manifest = json.load(fp)
+    return manifest['games'] if manifest.get('version') == MANIFEST_VERSION else None
+
+
+def patch_collection(games, manifest):
+    """
+    Patch the outputs of the last fetch
+    New games are loaded, removed games are dropped. Changed listing items are merged again with the cached
+    game data, which is only downloaded again once its cache entry expired
+
+    :param games: items of the fresh collection listing
+    :param manifest: manifest entries of the last fetch by item key
+    :return: the parsed games, None if the collection is unchanged
+    """
+    ttl_days = config['general'].get('api_cache_ttl_days')
+    # Items are tracked per owned copy, a game owned twice is listed twice
+    fresh = {item_key(game): game for game in games}
+    entries = {key: manifest_entry(game) for key, game in fresh.items()}
+    # Items edited by the owner, e.g. new plays or ratings
+    changed = {key for key, entry in entries.items() if key in manifest and (
+        manifest[key]['lastmodified'] != entry['lastmodified']
+        or manifest[key].get('user_digest') != entry['user_digest'])}
+    # Items with only new community data in the listing, e.g. numowned
+    refreshed = {key for key, entry in entries.items() if key in manifest and key not in changed
+                 and manifest[key]['digest'] != entry['digest']}
+    meta = get_store().meta_many({f'{game.get("objectid")}.xml' for key, game in fresh.items() if key in manifest})
+    expired = {key for key, game in fresh.items()
+               if key in manifest and not meta_is_fresh(meta.get(f'{game.get("objectid")}.xml'), ttl_days)}
+    added = [key for key in fresh if key not in manifest]
+    removed = {key for key in manifest if key not in fresh}
+    print(f'{len(added)} new, {len(changed)} changed, {len(refreshed)} with new community data, '
+          f'{len(expired)} expired and {len(removed)} removed items')
+    if not added and not changed and not refreshed and not expired and not removed:
+        print('Collection unchanged, keeping existing outputs')
+        return None
+
+    # The game data does not depend on the listing item, the cached response is merged with the new item,
+    # expired ones are revalidated by load_games
+    changed |= refreshed | expired
     print(f'\nCollecting game data:')
-    for game in collection.getroot().findall('item'):
-        game_id = game.get("objectid")
-        game_data = load_data(f'https://boardgamegeek.com/xmlapi/boardgame/{game_id}?stats=1', f'{game_id}.xml')
-        game.append(game_data.getroot().find('boardgame'))
-        csv_row = {
-            'id': game.get('objectid'),
-            'name': game.find('name').text,
-            'rank': game.find('./boardgame/statistics/ratings/ranks/rank[@name="boardgame"]').get('value'),
-            'yearpublished': game.find('yearpublished').text,
-            'minplayers': game.find('stats').get('minplayers'),
-            'maxplayers': game.find('stats').get('maxplayers'),
-            'userrating': game.find('./stats/rating').get('value'),
-            'numplays': game.find('numplays').text,
-            'minplaytime': game.find('stats').get('minplaytime'),
-            'maxplaytime': game.find('stats').get('maxplaytime'),
-            'age': game.find('./boardgame/age').text,
-            'weight': game.find('./boardgame/statistics/ratings/averageweight').text,
-            'owned': game.find('./boardgame/statistics/ratings/owned').text,
-            'bgg_usersrated': game.find('./boardgame/statistics/ratings/usersrated').text,
-            'bgg_ratingavg': game.find('./boardgame/statistics/ratings/average').text,
-            'bgg_ratingbay': game.find('./boardgame/statistics/ratings/bayesaverage').text,
-            'image': game.find('image').text.strip(),
-        }
-
-        categories_dict = {}
-        categories = game.findall('./boardgame/boardgamecategory')
-        for category in categories:
-            categories_dict[f'c_{category.text}'] = 'x'
-
-        csv_row.update(categories_dict)
-        csv_rows.append(csv_row)
-
-    # Finally dump combined data as XML
+    updated = merge_games([game for key, game in fresh.items() if key in changed or key not in manifest])
+    # Items are merged in listing order, changed items can be replaced in the order of the previous result
+    updated = {item_key(game): game for game in updated}
+
+    xml_file_path, _, _ = output_paths()
+    records = []
     print(f'\nWriting result to XML')
-    xml_file_path = os.path.join(config['general']['cache_directory'], f'{collection_file_key}.xml')
-    with open(xml_file_path, 'wb') as fp:
-        collection.write(fp, encoding='UTF-8')
+    with CollectionWriter(xml_file_path, read_root_attributes(xml_file_path)) as writer:
+        for game in iter_items(xml_file_path, pruned=False):
+            key = item_key(game)
+            if key in removed:
+                continue
+            if key in changed:
+                write_merged(writer, updated[key], records)
+            else:
+                writer.write(game)
+                records.append(Game.from_item(game))
+        for key in added:
+            write_merged(writer, updated[key], records)
     print(f'XML file written to {xml_file_path}')
 
-    # Write card summary data as CSV
-    print(f'\nWriting result to CSV')
-    csv_fields = []
-    for row in csv_rows:
-        for key in row.keys():
-            if key not in csv_fields:
-                csv_fields.append(key)
+    write_snapshot(snapshot_path(), records)
+    write_analytics(records)
+    write_manifest(entries)
+    return records
+
 
-    csv_file_path = os.path.join(config['general']['cache_directory'], f'{collection_file_key}.csv')
-    with open(csv_file_path, 'w', encoding='UTF-8', newline='') as fp:
-        writer = csv.DictWriter(fp, csv_fields)
-        writer.writeheader()
-        writer.writerows(csv_rows)
+def get_collection():
+    """
+    Get the collection and convert to json
 
-    print(f'CSV file written to {csv_file_path}')
+    :return: the parsed games of the collection, None if an unchanged collection was kept
+    """
+    # Keep one connection per worker alive
+    get_session(pool_size=config['fetch'].get('workers', 4))
+    get_rate_limiter()
+    incremental = config['fetch'].get('incremental', False)
+
+    # Find table containing collection, always fresh when fetching incremental
+    collection_file_key = config['general']['collection_file_key']
+    url = api_url(f'collection/{config["fetch"]["user"]}?own=1')
+    collection = load_data(url, file_name=f'{collection_file_key}.xml', ttl_days=0 if incremental else None)
+    games = collection.getroot().findall('item')
+
+    manifest = load_manifest() if incremental else None
+    if manifest is not None:
+        print(f'Parsed {len(games)} items, patching previous result')
+        return patch_collection(games, manifest)
+
+    print(f'Parsed {len(games)} items, writing JSON file')
+    manifest = {item_key(game): manifest_entry(game) for game in games}
+    print(f'\nCollecting game data:')
+    xml_file_path, _, _ = output_paths()
+    records = []
+    # Merged items are streamed to the file, only the compact records are kept
+    with CollectionWriter(xml_file_path, collection.getroot().attrib) as writer:
+        for game in merge_games(games):
+            write_merged(writer, game, records)
+    print(f'\nXML file written to {xml_file_path}')
+    write_snapshot(snapshot_path(), records)
+    write_analytics(records)
+    write_manifest(manifest)
+    return records
 
 
 if __name__ == '__main__':
-    get_collection()
+    metrics.run_main(get_collection, 'Fetch the collection and the game data from the BGG API')
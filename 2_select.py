@@ -1,16 +1,48 @@
+import ast
+import functools
+import heapq
 import os
-import xml.etree.ElementTree as ET
 
 from ruamel import yaml
 
-config = yaml.safe_load(open('config.yaml', 'r', encoding='utf-8'))
+import metrics
+from collection_stream import iter_items
+from game_store import NUMERIC_FIELDS, Game, read_snapshot, write_snapshot
+from settings import config
+
+# Selection criteria by name, filled by the criterion decorator
+CRITERIA = {}
+# Criteria of the default sets, used if the config defines no sets
+DEFAULT_CRITERIA = ['rank', 'best_for_two', 'best_for_many', 'user_played_often']
+# Names that can be used in scoring expressions besides the game fields
+EXPRESSION_FUNCTIONS = {'min': min, 'max': max, 'abs': abs}
+# Functions of the game that can be used in scoring expressions, e.g. best_at(3) for the share of best votes
+GAME_FUNCTIONS = {'best_at': lambda game, numplayers: game.best_share.get(str(numplayers), 0)}
+EXPRESSION_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant, ast.Name, ast.Load, ast.Call,
+                    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.USub, ast.UAdd)
 
 
 def load_collection():
+    """
+    Load the games of the collection
+    The binary snapshot is used if it is newer than the collection XML, otherwise the XML is parsed
+    and the snapshot is updated
+    """
     collection_file_key = config['general']['collection_file_key']
     collection_file_path = os.path.join(config['general']['cache_directory'], f'{collection_file_key}.xml')
-    collection = ET.parse(collection_file_path)
-    return collection.getroot().findall('item')
+    snapshot_file_path = os.path.join(config['general']['cache_directory'], f'{collection_file_key}.snapshot')
+    if os.path.exists(snapshot_file_path) and os.path.getmtime(snapshot_file_path) >= os.path.getmtime(
+            collection_file_path):
+        with metrics.timer('select.read_snapshot'):
+            games = read_snapshot(snapshot_file_path)
+        if games is not None:
+            metrics.count('select.snapshot_hit')
+            return games
+    metrics.count('select.snapshot_miss')
+    with metrics.timer('select.parse_xml'):
+        games = [Game.from_item(item) for item in iter_items(collection_file_path)]
+    write_snapshot(snapshot_file_path, games)
+    return games
 
 
 def compact_range(min_value, max_value):
@@ -40,28 +72,14 @@ def compact_number(number: int) -> str:
         return f'{number // 1000000}M'
 
 
-def compact_poll_result(poll_results) -> str:
+def compact_poll_result(best, recommended) -> str:
     """
     Compact the poll result
-    Calculate the recommended player count and best player count from poll results
-
-    :param poll_results: The poll result to compact
-    """
-    recommended = []
-    best = []
-    for results in poll_results:
-        result_options = results.findall('result')
-        total_votes = 0
-        for result_option in result_options:
-            total_votes += int(result_option.get('numvotes'))
-        voted_best = int(results.find('result[@value="Best"]').get('numvotes'))
-        voted_recommended = int(results.find('result[@value="Recommended"]').get('numvotes'))
-        if total_votes / 2 < voted_best:
-            best.append(results.get('numplayers'))
-            recommended.append(results.get('numplayers'))
-        if total_votes / 2 < voted_recommended + voted_best:
-            recommended.append(results.get('numplayers'))
+    Show the recommended player counts and the best player counts if they differ
 
+    :param best: player counts voted best, as indexed when the game was loaded
+    :param recommended: player counts voted at least recommended
+    """
     if group_to_str(best) == group_to_str(recommended):
         return f'{group_to_str(best)}'
     else:
@@ -81,56 +99,77 @@ def group_to_str(recommended):
         return compact_range(recommended[0], recommended[-1])
 
 
-def select_games(criteria, games, number_of_cards):
+def selection_entry(game):
+    """
+    Convert a game to the entry stored in the selection file
+
+    :param game: the selected game
+    """
+    name = game.name
+    if name in config['select']['replace_names']:
+        name = config['select']['replace_names'][name]
+
+    return {
+        '_id': game.id,
+        'name': name,
+        'image': game.image,
+
+        'year': str_or_none(game.year),
+        'playtime': compact_range(str_or_none(game.min_playtime), str_or_none(game.max_playtime)),
+        'rating': f"{game.average:.2f}",
+        'owners': compact_number(game.owned),
+        'weight': f"{game.weight:.2f}",
+
+        'players': compact_range(str_or_none(game.min_players), str_or_none(game.max_players)),
+        'players_recommended': compact_poll_result(game.best_players, game.recommended_players),
+        'age': f"{game.age}+",
+        'user_rating': game.user_rating,
+        'user_play_count': game.numplays
+    }
+
+
+def select_games(criteria, games, number_of_cards, selected_ids):
     """
     Select games based on criteria
     Selected cards are returned in a list
-    The input games are cleared of selected games to avoid duplicates
+    Games already selected for a previous set are skipped to avoid duplicates,
+    only the best games are kept while scanning, so no full sort is required
 
     :param criteria: criteria to select games
     :param games: list of games to select from
     :param number_of_cards: number of cards to select
-    :return: list of games left to select from
-    """
-    # Select cards to keep
-    sorted_games = sorted(games, key=lambda x: criteria(x))
-    selected_games = []
-    games_to_remove = []
-    for game in sorted_games:
-        poll_results = game.findall('./boardgame/poll[@name="suggested_numplayers"]/results')
-
-        name = game.find('name').text
-        if name in config['select']['replace_names']:
-            name = config['select']['replace_names'][name]
-
-        selected_games.append({
-            '_id': game.get('objectid'),
-            'name': name,
-            'image': game.find('image').text,
-
-            'year': game.find('yearpublished').text,
-            'playtime': compact_range(game.find('stats').get('minplaytime'), game.find('stats').get('maxplaytime')),
-            'rating': f"{float(game.find('./boardgame/statistics/ratings/average').text):.2f}",
-            'owners': compact_number(int(game.find('./boardgame/statistics/ratings/owned').text)),
-            'weight': f"{float(game.find('./boardgame/statistics/ratings/averageweight').text):.2f}",
-
-            'players': compact_range(game.find('stats').get('minplayers'), game.find('stats').get('maxplayers')),
-            'players_recommended': compact_poll_result(poll_results),
-            'age': f"{game.find('./boardgame/age').text}+",
-            'user_rating': game.find('./stats/rating').get('value'),
-            'user_play_count': int(game.find('numplays').text)
-        })
-        games_to_remove.append(game)
-        if len(selected_games) == number_of_cards:
-            break
-
-    # remove all selected games from games list
-    for game in games_to_remove:
-        games.remove(game)
-
-    return games, selected_games
+    :param selected_ids: ids of games selected before, the new selection is added
+    :return: list of selected games
+    """
+    # nsmallest keeps the order of the input for equal values, just like a stable sort
+    best_games = heapq.nsmallest(number_of_cards, (game for game in games if game.id not in selected_ids),
+                                 key=criteria)
+    selected_ids.update(game.id for game in best_games)
+    return [selection_entry(game) for game in best_games]
+
+
+def str_or_none(value):
+    """
+    Convert a parsed value back to text for display, keeping missing values
+
+    :param value: the value to convert
+    """
+    return None if value is None else str(value)
+
+
+def criterion(name):
+    """
+    Register a function as criterion that can be used by name in the set definitions
+
+    :param name: the name used in the config
+    """
+    def register(function):
+        CRITERIA[name] = function
+        return function
+    return register
 
 
+@criterion('rank')
 def by_rank(x, debug=False):
     """
     Filter criteria for games ranked by bgg
@@ -139,14 +178,14 @@ def by_rank(x, debug=False):
     :param debug: print the value used for debugging
     :return: a value to sort by
     """
-    rank_str = x.find('./boardgame/statistics/ratings/ranks/rank[@name="boardgame"]').get('value')
-    if rank_str == 'Not Ranked':
+    if x.rank is None:
         return 100000
     if debug:
-        print(f"{x.get('objectid')}: {rank_str}")
-    return int(rank_str)
+        print(f"{x.id}: {x.rank}")
+    return x.rank
 
 
+@criterion('best_for_two')
 def by_best_for_two(x, debug=False) -> float:
     """
     Filter criteria for "best for two" games
@@ -159,30 +198,62 @@ def by_best_for_two(x, debug=False) -> float:
     :param debug: print the value used for debugging
     :return: a value to sort by
     """
-    try:
-        max_players = int(x.find('stats').get('maxplayers'))
-        rating = float(x.find('./boardgame/statistics/ratings/average').text)
-        if max_players == 1:
-            return 100000
-        poll = x.find('./boardgame/poll[@name="suggested_numplayers"]/results[@numplayers="2"]')
-        # calculate poll percentage voted best
-        best = int(poll.find('result[@value="Best"]').get('numvotes'))
-        rec = int(poll.find('result[@value="Recommended"]').get('numvotes'))
-        not_rec = int(poll.find('result[@value="Not Recommended"]').get('numvotes'))
-        total = best + rec + not_rec
-        # calculate of best from total voted
-        if total == 0:
-            best_percentage = 0
-        else:
-            best_percentage = best / total
-    except TypeError:
-        print(f'Error parsing player count for {x.find("name").text}')
+    max_players = x.max_players
+    rating = x.average
+    if max_players is None or rating is None:
+        print(f'Error parsing player count for {x.name}')
         return 100000
+    if max_players == 1:
+        return 100000
+    # poll percentage voted best
+    best_percentage = x.best_share.get('2', 0)
     if debug:
-        print(f"{x.get('objectid')}: {best_percentage}, {rating / 10}, {max_players / 10}")
+        print(f"{x.id}: {best_percentage}, {rating / 10}, {max_players / 10}")
     return best_percentage * -1 - (rating / 10) + (max_players / 10)
 
 
+@criterion('best_solo')
+def by_best_solo(x, debug=False) -> float:
+    """
+    Filter criteria for games voted best as solo games
+
+    :param x: the game
+    :param debug: print the value used for debugging
+    :return: a value to sort by
+    """
+    return by_best_at(x, '1', debug)
+
+
+@criterion('best_for_three')
+def by_best_for_three(x, debug=False) -> float:
+    """
+    Filter criteria for games voted best with three players
+
+    :param x: the game
+    :param debug: print the value used for debugging
+    :return: a value to sort by
+    """
+    return by_best_at(x, '3', debug)
+
+
+def by_best_at(x, numplayers, debug=False) -> float:
+    """
+    Combine the share of best votes for a player count with the average rating, read from the poll index
+
+    :param x: the game
+    :param numplayers: the player count as used in the poll, e.g. 3 or 4+
+    :param debug: print the value used for debugging
+    """
+    rating = x.average
+    if rating is None:
+        return 100000
+    best_percentage = x.best_share.get(numplayers, 0)
+    if debug:
+        print(f"{x.id}: {best_percentage}, {rating / 10}")
+    return best_percentage * -1 - (rating / 10)
+
+
+@criterion('best_for_many')
 def by_best_for_many(x, debug=False) -> float:
     """
     Filter criteria for "best for many" games
@@ -190,17 +261,17 @@ def by_best_for_many(x, debug=False) -> float:
     :param debug: print the value used for debugging
     :return: a value to sort by
     """
-    try:
-        max_players = int(x.find('stats').get('maxplayers'))
-        rating = float(x.find('./boardgame/statistics/ratings/average').text)
-    except TypeError:
-        print(f'Error parsing player count for {x.find("name").text}')
+    max_players = x.max_players
+    rating = x.average
+    if max_players is None or rating is None:
+        print(f'Error parsing player count for {x.name}')
         return 100000
     if debug:
-        print(f"{x.get('objectid')}: {max_players}, {rating / 10}")
+        print(f"{x.id}: {max_players}, {rating / 10}")
     return max_players * -1 - (rating / 10)
 
 
+@criterion('user_played_often')
 def by_user_played_often(x, debug=False) -> float:
     """
     Filter criteria for games played often by the owner of the collection
@@ -209,59 +280,163 @@ def by_user_played_often(x, debug=False) -> float:
     :param debug: print the value used for debugging
     :return: a value to sort by
     """
-    try:
-        user_rating = float(x.find('./numplays').text)
-        rating = float(x.find('./boardgame/statistics/ratings/average').text)
-    except TypeError:
-        print(f'Error parsing user_rating for {x.find("name").text}')
+    user_rating = x.numplays
+    rating = x.average
+    if user_rating is None or rating is None:
+        print(f'Error parsing user_rating for {x.name}')
         return 100000
     if debug:
-        print(f"{x.get('objectid')}: {user_rating}, {rating / 10}")
+        print(f"{x.id}: {user_rating}, {rating / 10}")
     return user_rating * -1 - (rating / 10)
 
 
-if __name__ == '__main__':
-    games = load_collection()
+def compile_expression(expression):
+    """
+    Compile a scoring expression like "-numplays - average / 10" to a criterion
+    Only arithmetic on the game fields and the functions min, max, abs and best_at is allowed,
+    lower values are better
+
+    :param expression: the expression to compile
+    :return: a criterion function
+    """
+    tree = ast.parse(expression, mode='eval')
+    for node in ast.walk(tree):
+        if not isinstance(node, EXPRESSION_NODES):
+            raise ValueError(f'Unsupported syntax {type(node).__name__} in expression "{expression}"')
+        if isinstance(node, ast.Name) and node.id not in NUMERIC_FIELDS and node.id not in EXPRESSION_FUNCTIONS \
+                and node.id not in GAME_FUNCTIONS:
+            raise ValueError(f'Unknown name {node.id} in expression "{expression}", '
+                             f'use one of the numeric fields {", ".join(NUMERIC_FIELDS)}')
+        if isinstance(node, ast.Call) and not (isinstance(node.func, ast.Name) and (
+                node.func.id in EXPRESSION_FUNCTIONS or node.func.id in GAME_FUNCTIONS)):
+            raise ValueError(f'Unsupported function call in expression "{expression}"')
+    code = compile(tree, '<expression>', 'eval')
+
+    def by_expression(x, debug=False):
+        values = {field: getattr(x, field) for field in NUMERIC_FIELDS}
+        values.update({name: functools.partial(function, x) for name, function in GAME_FUNCTIONS.items()})
+        try:
+            value = eval(code, {'__builtins__': {}, **EXPRESSION_FUNCTIONS}, values)
+        except (TypeError, ZeroDivisionError):
+            # Missing values sort last like in the other criteria
+            return 100000
+        if debug:
+            print(f"{x.id}: {value}")
+        return value
+    return by_expression
+
+
+def compile_filters(filters):
+    """
+    Compile the filters of a set definition to a predicate
+    Numeric fields are limited with a dict of min and max, e.g. {"weight": {"max": 3}},
+    categories keeps games with any of the given names and exclude_categories those with none of them
+
+    :param filters: dict of filter names and values
+    :return: a function returning True for games passing all filters
+    """
+    checks = []
+    for name, value in (filters or {}).items():
+        if name == 'categories':
+            checks.append(lambda x, names=set(value): not names.isdisjoint(x.categories))
+        elif name == 'exclude_categories':
+            checks.append(lambda x, names=set(value): names.isdisjoint(x.categories))
+        elif name in NUMERIC_FIELDS and isinstance(value, dict):
+            lower = value.get('min', float('-inf'))
+            upper = value.get('max', float('inf'))
+            checks.append(lambda x, field=name, lower=lower, upper=upper: getattr(x, field) is not None
+                          and lower <= getattr(x, field) <= upper)
+        else:
+            raise ValueError(f'Unknown filter {name}, use categories, exclude_categories or one of the numeric '
+                             f'fields {", ".join(NUMERIC_FIELDS)} with min and max')
+    return lambda x: all(check(x) for check in checks)
+
+
+def set_definitions():
+    """
+    Get the definitions of the sets to select
+    Without sets in the config the four default sets are built from categories, base_colors and top_colors
+
+    :return: list of set definitions
+    """
+    if config['select'].get('sets'):
+        return config['select']['sets']
+    return [{'group': chr(ord('A') + index),
+             'criterion': name,
+             'category': config['select']['categories'][index],
+             'color': config['select']['base_colors'][index],
+             'top-color': config['select']['top_colors'][index]} for index, name in enumerate(DEFAULT_CRITERIA)]
+
+
+def select_sets(definitions, games):
+    """
+    Select the games of all sets
+    All criteria are evaluated in one pass over the games, then the sets are assigned in order,
+    a game can only be part of one set
+
+    :param definitions: list of set definitions
+    :param games: list of games to select from
+    :return: groups by group name
+    """
+    scorers = []
+    for definition in definitions:
+        if 'expression' in definition:
+            scorers.append(compile_expression(definition['expression']))
+        elif definition.get('criterion') in CRITERIA:
+            scorers.append(CRITERIA[definition['criterion']])
+        else:
+            raise ValueError(f'Unknown criterion {definition.get("criterion")}, use one of {", ".join(CRITERIA)}')
+    with metrics.timer('select.criteria'):
+        scores = {game.id: [scorer(game) for scorer in scorers] for game in games}
+    metrics.count('select.games', len(games))
+
+    groups = {}
+    selected_ids = set()
+    for index, definition in enumerate(definitions):
+        with metrics.timer('select.sets'):
+            passes = compile_filters(definition.get('filters'))
+            candidates = [game for game in games if passes(game)]
+            selected_game = select_games(lambda x: scores[x.id][index], candidates,
+                                         definition.get('games', config['select']['games_per_set']), selected_ids)
+        groups[definition.get('group', chr(ord('A') + index))] = {
+            'category': definition['category'],
+            'color': definition['color'],
+            'top-color': definition['top-color'],
+            'games': selected_game
+        }
+    return groups
+
+
+def select_collection(games=None, write=True):
+    """
+    Select the sets of games from the collection and write them to the selection file
+
+    :param games: the games of the collection, loaded from the last fetch if not given
+    :param write: write the selection file
+    :return: the selected groups by group name
+    """
+    if games is None:
+        games = load_collection()
     # Remove games that are in boardgamecategory "Expansion for Base-game" (1042)
-    games = [game for game in games if game.find('./boardgame/boardgamecategory[@objectid="1042"]') is None]
+    games = [game for game in games if '1042' not in game.category_ids]
     # filter out games that are excluded
-    excluded_games = config['select']['exclude']
-    games = [game for game in games if int(game.get('objectid')) not in excluded_games]
+    excluded_games = config['select']['exclude'] or []
+    games = [game for game in games if int(game.id) not in excluded_games]
 
     groups = {}
     # check if extra cards are defined
     if isinstance(config['select']['extra'], dict):
-        groups = config['select']['extra']
-    categories = config['select']['categories']
-    base_colors = config['select']['base_colors']
-    top_colors = config['select']['top_colors']
-
-    games, selected_game = select_games(by_rank, games, config['select']['games_per_set'])
-    groups['A'] = {'category': categories[0],
-                   'color': base_colors[0],
-                   'top-color': top_colors[0],
-                   'games': selected_game}
-    games, selected_game = select_games(by_best_for_two, games, config['select']['games_per_set'])
-    groups['B'] = {'category': categories[1],
-                   'color': base_colors[1],
-                   'top-color': top_colors[1],
-                   'games': selected_game
-                   }
-    games, selected_game = select_games(by_best_for_many, games, config['select']['games_per_set'])
-    groups['C'] = {'category': categories[2],
-                   'color': base_colors[2],
-                   'top-color': top_colors[2],
-                   'games': selected_game
-                   }
-    games, selected_game = select_games(by_user_played_often, games, config['select']['games_per_set'])
-    groups['D'] = {'category': categories[3],
-                   'color': base_colors[3],
-                   'top-color': top_colors[3],
-                   'games': selected_game
-                   }
-
-    # selection file path
-    selection_file = os.path.join(config['general']['cache_directory'], config['general']['selection_file_key'])
-    # write groups to yaml file
-    with open(selection_file, 'w', encoding='utf-8') as f:
-        yaml.dump({"groups": groups}, f, allow_unicode=True, default_flow_style=False)
+        groups = dict(config['select']['extra'])
+    groups.update(select_sets(set_definitions(), games))
+
+    if write:
+        # selection file path
+        selection_file = os.path.join(config['general']['cache_directory'], config['general']['selection_file_key'])
+        # write groups to yaml file
+        with metrics.timer('select.write_yaml'), open(selection_file, 'w', encoding='utf-8') as f:
+            yaml.dump({"groups": groups}, f, allow_unicode=True, default_flow_style=False)
+    return groups
+
+
+if __name__ == '__main__':
+    metrics.run_main(select_collection, 'Select the sets of games from the collection')
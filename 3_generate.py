@@ -1,14 +1,44 @@
+import functools
+import hashlib
+import json
 import os
 import shutil
-import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from time import perf_counter
 
-import requests
 from PIL import Image, ImageDraw, ImageFont, ImageColor
 from ruamel import yaml
 
+import metrics
+from http_client import fetch_cached, is_fresh, write_atomic
+from image_cache import evict, load_derived_image, source_hash
+from settings import config, use_config
+
 CONVERSION_IN_MM = 25.4
 
-config = yaml.safe_load(open('config.yaml', 'r', encoding='utf-8'))
+# Increase when a change of the rendering code changes the cards, all cards are rendered again
+RENDER_VERSION = 1
+RENDER_MANIFEST = 'manifest.json'
+# Generate config values that do not change how a card looks
+RENDER_INDEPENDENT_KEYS = ('cards_directory', 'workers', 'incremental', 'save_workers', 'image_workers')
+
+# Output formats as file extension and Pillow format name
+OUTPUT_FORMATS = {
+    'png': ('.png', 'PNG'),
+    'webp': ('.webp', 'WEBP'),
+    'jpeg': ('.jpg', 'JPEG'),
+    'tiff': ('.tif', 'TIFF'),
+}
+
+# zlib strategies for the png_strategy setting
+PNG_STRATEGIES = {
+    'default': 0,
+    'filtered': 1,
+    'huffman_only': 2,
+    'rle': 3,
+    'fixed': 4,
+}
 
 ICONS = [
     ('iconmonstr-calendar-4-240.png', 10, 59),
@@ -26,157 +56,621 @@ ICONS = [
 
 
 def get_selection(selection_file):
-    selected_games = []
     with open(selection_file, 'r', encoding='utf-8') as fp:
-        groups = yaml.safe_load(fp)['groups']
-        # iterate over key and value of dict groups
-        for group_name, group_data in groups.items():
-            # loop over games dictionary with index
-            for index, game in enumerate(group_data['games']):
-                game['index'] = index
-                game['group'] = group_name
-                game['category'] = group_data['category']
-                game['color'] = group_data['color']
-                game['top-color'] = group_data['top-color']
-                selected_games.append(game)
+        return selection_cards(yaml.safe_load(fp)['groups'])
+
+
+def selection_cards(groups):
+    """
+    Get the data of each card of the selected groups, the groups are not modified
+
+    :param groups: the groups as selected by 2_select.py
+    :return: list of card data
+    """
+    selected_games = []
+    # iterate over key and value of dict groups
+    for group_name, group_data in groups.items():
+        # loop over games dictionary with index
+        for index, game in enumerate(group_data['games']):
+            selected_games.append(dict(game, index=index, group=group_name, category=group_data['category'],
+                                       color=group_data['color'], **{'top-color': group_data['top-color']}))
     return selected_games
 
 
-def generate_cards():
-    if not os.path.exists(config['generate']['cards_directory']):
-        os.mkdir(config['generate']['cards_directory'])
+def load_selection(card_selection=None):
+    """
+    Get the cards to render, read from the selection file unless they are given
+
+    :param card_selection: card data as returned by selection_cards
+    """
+    if card_selection is not None:
+        return card_selection
+    selection_file_path = os.path.join(config['general']['cache_directory'], config['general']['selection_file_key'])
+    return get_selection(selection_file_path)
+
+
+def init_worker(values):
+    """
+    Prepare a render process, the config of the parent process is used
+
+    :param values: the config of the parent process
+    """
+    use_config(values)
+    # Forked processes start with a copy of the metrics of the parent, which are already counted there
+    metrics.reset()
+
+
+def generate_cards(card_selection=None):
+    """
+    Render all cards of the selection and the card back with a pool of processes
+    With incremental rendering, cards with unchanged inputs are skipped
+
+    :param card_selection: card data to render, defaults to the cards of the selection file
+    :return: list of the names of cards that failed to render
+    """
+    os.makedirs(config['generate']['cards_directory'], exist_ok=True)
     image_cache_path = os.path.join(config['general']['cache_directory'], config['general']['image_cache_directory'])
-    if not os.path.exists(image_cache_path):
-        os.mkdir(image_cache_path)
+    os.makedirs(image_cache_path, exist_ok=True)
 
     generate_config = config['generate']
-    selection_file_path = os.path.join(config['general']['cache_directory'], config['general']['selection_file_key'])
-    card_selection = get_selection(selection_file_path)
-    for card_data in card_selection:
-        threading.Thread(target=render_as_card, args=(card_data, generate_config)).start()
-    render_card_back(generate_config)
+    card_selection = load_selection(card_selection)
+
+    # Cards to render as (name, file name, render function with its arguments, card data)
+    jobs = [(f'{card_data["group"]}{card_data["index"]} {card_data["name"]}', card_file_name(card_data),
+             (render_as_card, card_data, generate_config), card_data) for card_data in card_selection]
+    jobs.append(('card back', card_back_file_name(), (render_card_back, generate_config), None))
+
+    incremental = generate_config.get('incremental', False)
+    previous = load_render_manifest() if incremental else {}
+    manifest = {}
+    pending = []
+    for name, file_name, call, card_data in jobs:
+        if file_name in previous and os.path.exists(os.path.join(generate_config['cards_directory'], file_name)):
+            fingerprint = render_fingerprint(card_data)
+            if fingerprint is not None and fingerprint == previous[file_name]:
+                manifest[file_name] = fingerprint
+                continue
+        pending.append((name, file_name, call, card_data))
+    metrics.count('generate.unchanged', len(jobs) - len(pending))
+    if incremental:
+        print(f'{len(jobs) - len(pending)} of {len(jobs)} cards are unchanged')
+
+    failed = []
+    start = perf_counter()
+    if pending:
+        workers = min(generate_config.get('workers') or os.cpu_count(), len(pending))
+        save_workers = generate_config.get('save_workers') or 0
+        image_workers = max(1, generate_config.get('image_workers') or 8)
+        # Cards sharing an image url wait for the same download, the card back needs no download
+        image_jobs = {}
+        ready = deque()
+        for job in pending:
+            if job[3] is None:
+                ready.append(job)
+            else:
+                image_jobs.setdefault(job[3]['image'], []).append(job)
+        remaining_images = iter(image_jobs.values())
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(dict(config),)) as executor, \
+                ThreadPoolExecutor(max_workers=max(save_workers, 1)) as writer, \
+                ThreadPoolExecutor(max_workers=image_workers) as downloader:
+            # Running downloads, renders and writes by future, rendered cards waiting for the writer are held in
+            # memory, so only a few cards are started ahead of the writer
+            running = {}
+            downloads = {}
+
+            def start_next():
+                # Downloads run ahead of the renders, but only a bounded number of cards waits for a render
+                while len(downloads) < image_workers and len(ready) < 2 * workers + image_workers:
+                    jobs = next(remaining_images, None)
+                    if jobs is None:
+                        break
+                    downloads[downloader.submit(prefetch_image, [job[3] for job in jobs])] = jobs
+                while ready and len(running) < 2 * workers + save_workers:
+                    name, file_name, call, card_data = ready.popleft()
+                    # The image is already downloaded, the render only reads it
+                    image = {} if card_data is None else {'image_path': cached_image_path(card_data['_id'])}
+                    running[executor.submit(*call, save=not save_workers, **image)] = (name, file_name, card_data)
+
+            start_next()
+            done = 0
+            while running or downloads:
+                finished, _ = wait([*running, *downloads], return_when=FIRST_COMPLETED)
+                for future in finished:
+                    if future in downloads:
+                        jobs = downloads.pop(future)
+                        try:
+                            future.result()
+                            ready.extend(jobs)
+                        except Exception as e:
+                            for name, _, _, _ in jobs:
+                                done += 1
+                                metrics.count('generate.failed')
+                                print(f'[{done}/{len(pending)}] Failed to render {name}: {e}')
+                                failed.append(name)
+                        start_next()
+                        continue
+                    name, file_name, card_data = running.pop(future)
+                    try:
+                        image, card_metrics = future.result()
+                        if card_metrics is not None:
+                            metrics.merge(card_metrics)
+                        if image is not None:
+                            card_path = os.path.join(generate_config['cards_directory'], file_name)
+                            running[writer.submit(write_card, image, card_path, generate_config)] = \
+                                (name, file_name, card_data)
+                            continue
+                        done += 1
+                        metrics.count('generate.rendered')
+                        print(f'[{done}/{len(pending)}] Rendered {name}')
+                        manifest[file_name] = render_fingerprint(card_data)
+                    except Exception as e:
+                        done += 1
+                        metrics.count('generate.failed')
+                        print(f'[{done}/{len(pending)}] Failed to render {name}: {e}')
+                        failed.append(name)
+                    start_next()
+        timers = metrics.snapshot()['timers']
+        print(f'Rendered {len(pending) - len(failed)} cards in {perf_counter() - start:.2f}s, summed over the '
+              f'workers: ' + ', '.join(f'{stage} {timers[f"generate.{stage}"]["seconds"]:.2f}s'
+                                       for stage in ('image', 'draw', 'save') if f'generate.{stage}' in timers))
+    write_render_manifest(manifest)
+
+    removed = evict(derived_image_directory(), config['general'].get('derived_image_cache_mb'))
+    if removed:
+        print(f'Removed {removed} least recently used resized images from the cache')
+
+    if failed:
+        print(f'\n{len(failed)} of {len(pending)} cards failed: {", ".join(failed)}')
+    return failed
+
+
+def card_file_name(card_data):
+    """
+    Get the file name of the card of a game
+
+    :param card_data: The data of the game
+    """
+    return f'{card_data["group"]}{card_data["index"]}-{card_data["_id"]}{output_format()[0]}'
 
 
-def fetch_image(game_id, url):
-    image_path = os.path.join(
-        config['general']['cache_directory'],
-        config['general']['image_cache_directory'],
-        f"{game_id}.jpg")
-    if os.path.exists(image_path):
-        return image_path
+def card_back_file_name():
+    """
+    Get the file name of the card back, its extension follows the output format
+    """
+    return os.path.splitext(config['generate']['card_back_file_name'])[0] + output_format()[0]
+
+
+def output_format():
+    """
+    Get the file extension and Pillow format name of the configured output format
+    """
+    return OUTPUT_FORMATS[config['generate'].get('output_format') or 'png']
+
+
+def save_options(gen_config):
+    """
+    Get the Pillow save options of the configured output format
+
+    :param gen_config: The card generation configuration
+    """
+    output = gen_config.get('output_format') or 'png'
+    if output == 'png':
+        return {'compress_level': gen_config.get('png_compress_level', 6),
+                'compress_type': PNG_STRATEGIES[gen_config.get('png_strategy') or 'default']}
+    if output == 'webp':
+        return {'lossless': True, 'method': gen_config.get('webp_method', 4)}
+    if output == 'jpeg':
+        return {'quality': gen_config.get('jpeg_quality', 95), 'subsampling': 0}
+    return {'compression': gen_config.get('tiff_compression') or 'tiff_lzw'}
+
+
+def save_card(image, card_path, gen_config):
+    """
+    Encode and write a card in the configured output format, TIFF files are written in the output color mode
+
+    :param image: the rendered card
+    :param card_path: path of the card file
+    :param gen_config: The card generation configuration
+    """
+    output = gen_config.get('output_format') or 'png'
+    if output == 'tiff':
+        image = image.convert(gen_config.get('color_mode') or 'RGB')
+    image.save(card_path, OUTPUT_FORMATS[output][1], **save_options(gen_config))
+
+
+def write_card(image, card_path, gen_config):
+    """
+    Save a card, used by the writer threads
+
+    :return: no image and no metrics, the time is added to the metrics of the main process
+    """
+    with metrics.timer('generate.save'):
+        save_card(image, card_path, gen_config)
+    return None, None
+
+
+def render_manifest_path():
+    """
+    Get the path of the manifest listing the fingerprints of the rendered cards
+    """
+    return os.path.join(config['generate']['cards_directory'], RENDER_MANIFEST)
+
+
+def load_render_manifest():
+    """
+    Load the fingerprints of the cards rendered by the last run
+
+    :return: fingerprints by card file name, empty if there is no manifest or it is from another version
+    """
+    try:
+        with open(render_manifest_path(), 'r', encoding='utf-8') as fp:
+            manifest = json.load(fp)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('version') != RENDER_VERSION:
+        return {}
+    return manifest['cards']
+
+
+def write_render_manifest(manifest):
+    """
+    Store the fingerprints of the rendered cards
+
+    :param manifest: fingerprints by card file name
+    """
+    write_atomic(render_manifest_path(),
+                 json.dumps({'version': RENDER_VERSION, 'cards': manifest}, indent=1, sort_keys=True).encode('utf-8'))
+
+
+def render_fingerprint(card_data):
+    """
+    Fingerprint all inputs of a card: the game data, the generate config, fonts, icons and artwork
+
+    :param card_data: The data of the game, None for the card back
+    :return: the fingerprint, None if the artwork is not cached or has to be revalidated
+    """
+    gen_config = config['generate']
+    inputs = {
+        'version': RENDER_VERSION,
+        'generate': {key: value for key, value in gen_config.items() if key not in RENDER_INDEPENDENT_KEYS},
+    }
+    if card_data is None:
+        inputs['files'] = [file_hash(gen_config['card_back_image'])]
     else:
-        print('Fetching image from web')
-        res = requests.get(url, stream=True)
-        if res.status_code == 200:
-            with open(image_path, 'wb') as image:
-                shutil.copyfileobj(res.raw, image)
-            return image_path
+        image_path = cached_image_path(card_data['_id'])
+        if not is_fresh(image_path, config['general'].get('image_cache_ttl_days')):
+            return None
+        inputs['card'] = card_data
+        inputs['files'] = [file_hash(gen_config['font_heading']), file_hash(gen_config['font_main']),
+                           source_hash(image_path)]
+        inputs['files'] += [file_hash(os.path.join('resources', icon[0])) for icon in ICONS]
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def file_hash(path):
+    """
+    Hash of the content of a resource file, None if the file is missing
+    """
+    try:
+        return source_hash(path)
+    except OSError:
+        return None
+
+
+def cached_image_path(game_id):
+    """
+    Get the path of the cached image of a game
+
+    :param game_id: id of the game
+    """
+    return os.path.join(config['general']['cache_directory'], config['general']['image_cache_directory'],
+                        f"{game_id}.jpg")
+
+
+def fetch_image(game_id, url):
+    """
+    Get the path of the cached image of a game, downloading it if required
+
+    :param game_id: id of the game
+    :param url: url of the image
+    """
+    image_path = cached_image_path(game_id)
+    try:
+        downloaded = fetch_cached(url, image_path, f'image {game_id}', config['general'].get('image_cache_ttl_days'),
+                                  stream=True)
+    except (RuntimeError, OSError) as e:
+        raise RuntimeError(f'Failed to fetch image with id {game_id} from {url}: {e}') from e
+    if downloaded:
+        check_image(image_path, game_id, url)
+    return image_path
+
+
+def check_image(image_path, game_id, url):
+    """
+    Make sure a downloaded image can be read, any format Pillow reads is accepted
+    Invalid downloads like error pages are removed from the cache, so they are fetched again on the next run
+
+    :param image_path: path of the downloaded image
+    :param game_id: id of the game
+    :param url: url of the image
+    """
+    try:
+        with Image.open(image_path) as image:
+            image.verify()
+    except (OSError, SyntaxError, ValueError) as e:
+        metrics.count('generate.invalid_image')
+        for path in (image_path, f'{image_path}.meta'):
+            if os.path.exists(path):
+                os.remove(path)
+        raise RuntimeError(f'Image with id {game_id} from {url} is not a valid image: {e}') from e
+
+
+def prefetch_image(cards):
+    """
+    Download the image of cards sharing an image url once, the other games get a copy of the cached image
+
+    :param cards: card data of the cards using the same image url
+    """
+    with metrics.timer('generate.prefetch'):
+        image_path = fetch_image(cards[0]['_id'], cards[0]['image'])
+        for card_data in cards[1:]:
+            shared_path = cached_image_path(card_data['_id'])
+            if shared_path != image_path and not is_fresh(shared_path, config['general'].get('image_cache_ttl_days')):
+                # The metadata is copied last, so the copy is only fresh once the image is complete
+                for suffix in ('', '.meta'):
+                    shutil.copyfile(f'{image_path}{suffix}', f'{shared_path}{suffix}.tmp')
+                    os.replace(f'{shared_path}{suffix}.tmp', f'{shared_path}{suffix}')
+
+
+def derived_image_directory():
+    """
+    Get the directory of the resized game images
+    """
+    return os.path.join(config['general']['cache_directory'],
+                        config['general'].get('derived_image_cache_directory', 'images-derived'))
+
+
+def load_game_image(game_id, image_path, max_width, max_height):
+    """
+    Load the image of a game resized for the card, resized images are cached per source, size and dpi
+
+    :param game_id: id of the game
+    :param image_path: path of the full image
+    :param max_width: the maximum width after resize
+    :param max_height: the maximum height after resize
+    """
+    return load_derived_image(derived_image_directory(), game_id, image_path, max_width, max_height,
+                              int(config['generate']['dpi']), config['generate'].get('image_resample', 'bicubic'))
+
+
+@functools.lru_cache(maxsize=None)
+def load_font(font_path, size):
+    """
+    Load a font, fonts are loaded once per process and size
+
+    :param font_path: path of the font file
+    :param size: the font size in pixel
+    """
+    return ImageFont.truetype(font_path, size)
+
+
+@functools.lru_cache(maxsize=16384)
+def measure_text(font_path, size, text):
+    """
+    Measure a single line of text, measurements are cached per font, size and text
+
+    :param font_path: path of the font file
+    :param size: the font size in pixel
+    :param text: the text to measure
+    :return: the bounding box of the text drawn at the origin
+    """
+    return load_font(font_path, size).getbbox(text)
+
+
+def fit_text(text, font_path, max_width, max_size, max_height=None):
+    """
+    Find the largest font size the text fits into, using a binary search
+
+    :param text: the text to fit
+    :param font_path: path of the font file
+    :param max_width: the available width in pixel
+    :param max_size: the largest font size to use in pixel
+    :param max_height: optional limit in pixel for the font size plus the height of a capital letter,
+        used for two lines of text
+    :return: the font size in pixel
+    """
+    def fits(size):
+        _, _, width, _ = measure_text(font_path, size, text)
+        if max_height is not None:
+            _, top, _, bottom = measure_text(font_path, size, 'A')
+            if size + bottom - top > max_height:
+                return False
+        return width <= max_width
+
+    if fits(max_size):
+        return max_size
+    low, high = 1, max_size - 1
+    while low < high:
+        middle = (low + high + 1) // 2
+        if fits(middle):
+            low = middle
         else:
-            print(f'Failed to fetch image with id {id} from {url}')
-            exit(1)
+            high = middle - 1
+    return low
 
 
-def render_as_card(card_data, gen_config):
+def layout_text(text, font_path, max_width, max_size, wrap=False, max_height=None):
     """
-    Render a game as a card
+    Lay out a text in a box, shrinking the font and optionally wrapping onto two lines
+
+    :param text: the text to lay out
+    :param font_path: path of the font file
+    :param max_width: the available width in pixel
+    :param max_size: the largest font size to use in pixel
+    :param wrap: allow two lines if this allows a larger font
+    :param max_height: the available height in pixel for two lines
+    :return: the font size and the list of lines
+    """
+    size = fit_text(text, font_path, max_width, max_size)
+    words = text.split(' ')
+    if not wrap or len(words) < 2 or size == max_size:
+        return size, [text]
+    # Split where the longer line is the shortest
+    splits = [(' '.join(words[:i]), ' '.join(words[i:])) for i in range(1, len(words))]
+    lines = min(splits, key=lambda split: max(measure_text(font_path, max_size, line)[2] for line in split))
+    wrapped_size = min(fit_text(line, font_path, max_width, max_size, max_height) for line in lines)
+    if wrapped_size > size:
+        return wrapped_size, list(lines)
+    return size, [text]
+
+
+def card_template(gen_config, category, color, top_color):
+    """
+    Get the chrome shared by all cards of a group: border, header, boxes, icons and category
+    Templates are rendered once per process and group
 
-    :param card_data: The data of the game
     :param gen_config: The card generation configuration
+    :param category: The category shown in the header
+    :param color: The base color of the group
+    :param top_color: The header color of the group
     """
-    print_width = dpi(gen_config['width'])
-    print_height = dpi(gen_config['height'])
-    cut_border = dpi(gen_config['cut_border'])
-    card_border = dpi(gen_config['card_border'])
+    return _card_template(int(config['generate']['dpi']), gen_config['width'], gen_config['height'],
+                          gen_config['cut_border'], gen_config['card_border'], gen_config['print_cut_border'],
+                          gen_config['box_color'], gen_config['font_heading'], category, color, top_color)
+
+
+@functools.lru_cache(maxsize=None)
+def _card_template(dpi_value, width_mm, height_mm, cut_border_mm, card_border_mm, print_cut_border, box_color,
+                   font_heading, category, color, top_color):
+    print_width = dpi(width_mm)
+    print_height = dpi(height_mm)
+    cut_border = dpi(cut_border_mm)
+    card_border = dpi(card_border_mm)
     width = print_width + 2 * cut_border
     height = print_height + 2 * cut_border
 
     # create an image
     out = Image.new('RGB', (width, height), color=(255, 255, 255))
 
-    # get a font
-    fnt = ImageFont.truetype(gen_config['font_main'], dpi(4))
-    fnt_heading = ImageFont.truetype(gen_config['font_heading'], dpi(4.8))
-
-    # Fetch and add image
-    image_path = fetch_image(card_data['_id'], card_data['image'])
-    game_image = load_sized_image(image_path, dpi(49), dpi(37))
-
     # get a drawing context
     d = ImageDraw.Draw(out)
-    if gen_config['print_cut_border']:
+    if print_cut_border:
         d.rounded_rectangle((cut_border, cut_border, print_width + cut_border, print_height + cut_border),
                             radius=dpi(5), width=1, outline=(200, 200, 200))
     d.rounded_rectangle((cut_border + card_border, cut_border + card_border,
                          print_width + cut_border - card_border, print_height + cut_border - card_border),
-                        radius=dpi(3), width=1, fill=ImageColor.getrgb(card_data['color']))
+                        radius=dpi(3), width=1, fill=ImageColor.getrgb(color))
 
     # Create backdrop for game name
     d.rounded_rectangle((dpi(9), dpi(52), dpi(56), dpi(57)),
-                        radius=dpi(1), fill=ImageColor.getrgb(gen_config['box_color']))
+                        radius=dpi(1), fill=ImageColor.getrgb(box_color))
 
     # Create backdrop for game stats
-    add_boxes(d, dpi(9), dpi(58), dpi(30), dpi(5), dpi(6), 5, gen_config['box_color'])
-    add_boxes(d, dpi(35), dpi(58), dpi(56), dpi(5), dpi(6), 5, gen_config['box_color'])
+    add_boxes(d, dpi(9), dpi(58), dpi(30), dpi(5), dpi(6), 5, box_color)
+    add_boxes(d, dpi(35), dpi(58), dpi(56), dpi(5), dpi(6), 5, box_color)
 
     # Create backdrop for header
     d.rounded_rectangle(
         (cut_border + card_border, cut_border + card_border, print_width + cut_border - card_border, dpi(20)),
-        fill=ImageColor.getrgb(card_data['top-color']), radius=dpi(3))
+        fill=ImageColor.getrgb(top_color), radius=dpi(3))
     d.rectangle((cut_border + card_border, dpi(13), print_width + cut_border - card_border, dpi(20)),
-                fill=ImageColor.getrgb(card_data['color']))
+                fill=ImageColor.getrgb(color))
+
+    # Render category to header
+    category_size = fit_text(category, font_heading, dpi(47.5), dpi(4.8))
+    _, _, text_width, _ = measure_text(font_heading, category_size, category)
+    d.text(((width - text_width) / 2, dpi(7)), category, font=load_font(font_heading, category_size),
+           fill=(255, 255, 255))
+
+    # load image with transparency, icons do not overlap with the text and image added per card
+    for icon in ICONS:
+        add_icon(out, icon[0], icon[1], icon[2])
+    return out
+
+
+def render_as_card(card_data, gen_config, save=True, image_path=None):
+    """
+    Render a game as a card
+    Only the texts and the game image are drawn per card, the rest is copied from the group template
+
+    :param card_data: The data of the game
+    :param gen_config: The card generation configuration
+    :param save: save the card, otherwise the card is returned to be saved by the caller
+    :param image_path: path of the downloaded game image, fetched by the render if not given
+    :return: the card if it was not saved and the metrics of rendering the card
+    """
+    before = metrics.snapshot()
+    start = perf_counter()
+    out = card_template(gen_config, card_data['category'], card_data['color'], card_data['top-color']).copy()
+    width = out.width
+
+    # get a font
+    fnt_heading = load_font(gen_config['font_heading'], dpi(4.8))
+
+    # Fetch and add image
+    image_start = perf_counter()
+    if image_path is None:
+        image_path = fetch_image(card_data['_id'], card_data['image'])
+    game_image = load_game_image(card_data['_id'], image_path, dpi(49), dpi(37))
+    image_time = perf_counter() - image_start
+    metrics.add_time('generate.image', image_time)
+
+    # get a drawing context
+    d = ImageDraw.Draw(out)
 
     # Render header card
     d.text((dpi(8), dpi(7)), f"{card_data['index']}{card_data['group']}", font=fnt_heading, fill=(255, 255, 255))
-    _, _, text_width, _ = d.textbbox((0, 0), card_data['category'], font=fnt_heading)
-    d.text(((width - text_width) / 2, dpi(7)), card_data['category'], font=fnt_heading, fill=(255, 255, 255))
 
-    # Define default font size for game name
-    font_size = 4.8
-    fnt_game_name = ImageFont.truetype(gen_config['font_heading'], dpi(font_size))
-
-    # Calculate the font size to fit the game name box
-    _, _, text_width, _ = d.textbbox((0, 0), card_data['name'], font=fnt_game_name)
+    # Fit the game name into its box, shrinking the font or wrapping it onto two lines
+    font_heading = gen_config['font_heading']
+    with metrics.timer('generate.text_layout'):
+        font_size, lines = layout_text(card_data['name'], font_heading, dpi(47.5), dpi(4.8),
+                                       wrap=gen_config.get('wrap_names', False), max_height=dpi(4))
+    fnt_game_name = load_font(font_heading, font_size)
     # Calculate letter baseline for vertical positioning
-    _, _, _, text_height = d.textbbox((0, 0), "A", font=fnt_game_name)
-    while text_width > dpi(47.5):
-        font_size -= 0.2
-        fnt_game_name = ImageFont.truetype(gen_config['font_heading'], dpi(font_size))
-        _, _, text_width, _ = d.textbbox((0, 0), card_data['name'], font=fnt_game_name)
-        _, _, _, text_height = d.textbbox((0, 0), "A", font=fnt_game_name)
+    _, _, _, text_height = measure_text(font_heading, font_size, 'A')
+    if len(lines) == 1:
+        top = dpi(55.8) - text_height
+    else:
+        top = dpi(56.3) - text_height - font_size
 
     # Render game name to canvas
-    d.text(((width - text_width) / 2, dpi(55.8) - text_height), card_data['name'], font=fnt_game_name, fill=(0, 0, 0))
+    for line in lines:
+        _, _, text_width, _ = measure_text(font_heading, font_size, line)
+        d.text(((width - text_width) / 2, top), line, font=fnt_game_name, fill=(0, 0, 0))
+        top += font_size
 
     # Draw game stats for the left side
-    d.text((dpi(14), dpi(58)), card_data['year'], font=fnt, fill=(0, 0, 0))
-    d.text((dpi(14), dpi(64)), card_data['playtime'], font=fnt, fill=(0, 0, 0))
-    d.text((dpi(14), dpi(70)), card_data['rating'], font=fnt, fill=(0, 0, 0))
-    d.text((dpi(14), dpi(76)), card_data['owners'], font=fnt, fill=(0, 0, 0))
-    d.text((dpi(14), dpi(82)), card_data['weight'], font=fnt, fill=(0, 0, 0))
+    add_stat(d, dpi(14), dpi(58), card_data['year'], gen_config['font_main'])
+    add_stat(d, dpi(14), dpi(64), card_data['playtime'], gen_config['font_main'])
+    add_stat(d, dpi(14), dpi(70), card_data['rating'], gen_config['font_main'])
+    add_stat(d, dpi(14), dpi(76), card_data['owners'], gen_config['font_main'])
+    add_stat(d, dpi(14), dpi(82), card_data['weight'], gen_config['font_main'])
 
     # Draw game stats for the right side
-    d.text((dpi(40), dpi(58)), card_data['players'], font=fnt, fill=(0, 0, 0))
-    d.text((dpi(40), dpi(64)), card_data['players_recommended'], font=fnt, fill=(0, 0, 0))
-    d.text((dpi(40), dpi(70)), card_data['age'], font=fnt, fill=(0, 0, 0))
+    add_stat(d, dpi(40), dpi(58), card_data['players'], gen_config['font_main'])
+    add_stat(d, dpi(40), dpi(64), card_data['players_recommended'], gen_config['font_main'])
+    add_stat(d, dpi(40), dpi(70), card_data['age'], gen_config['font_main'])
     if card_data['user_rating'] != 'N/A':
-        d.text((dpi(40), dpi(76)), card_data['user_rating'], font=fnt, fill=(0, 0, 0))
+        add_stat(d, dpi(40), dpi(76), card_data['user_rating'], gen_config['font_main'])
     if card_data['user_play_count'] > 10:
-        d.text((dpi(40), dpi(82)), str(card_data['user_play_count']), font=fnt, fill=(0, 0, 0))
+        add_stat(d, dpi(40), dpi(82), str(card_data['user_play_count']), gen_config['font_main'])
     else:
         add_lines(d, dpi(40), dpi(83), card_data['user_play_count'])
 
-    card_file_name = f'{card_data["group"]}{card_data["index"]}-{card_data["_id"]}.png'
-    card_path = os.path.join(gen_config['cards_directory'], card_file_name)
+    card_path = os.path.join(gen_config['cards_directory'], card_file_name(card_data))
     # Add the game image
     out.paste(game_image, (int(width / 2 - game_image.width / 2), dpi(14)))
 
-    # load image with transparency
-    for icon in ICONS:
-        add_icon(out, icon[0], icon[1], icon[2])
+    metrics.add_time('generate.draw', perf_counter() - start - image_time)
+    if not save:
+        return out, metrics.since(before)
 
     # Save results
-    out.save(card_path)
+    with metrics.timer('generate.save'):
+        save_card(out, card_path, gen_config)
     print(f'Created card for game {card_data["_id"]} in {card_path}')
+    return None, metrics.since(before)
 
 
 def add_icon(out, icon_name, position_x, position_y):
@@ -188,10 +682,36 @@ def add_icon(out, icon_name, position_x, position_y):
     :param position_x: The x position of the icon
     :param position_y: The y position of the icon
     """
-    icon = load_sized_image(os.path.join('resources', icon_name), dpi(3), dpi(3))
+    icon = load_icon(icon_name, dpi(3))
     out.paste(icon, (dpi(position_x), dpi(position_y)), icon)
 
 
+@functools.lru_cache(maxsize=None)
+def load_icon(icon_name, size):
+    """
+    Load an icon from the resources, icons are decoded and resized once per process and size
+
+    :param icon_name: The name of the icon
+    :param size: The maximum width and height of the icon
+    """
+    return load_sized_image(os.path.join('resources', icon_name), size, size)
+
+
+def add_stat(canvas, x, y, value, font_path):
+    """
+    Add a stat to its box, long values are shrunk to fit the box
+
+    :param canvas: the canvas to add the stat to
+    :param x: the x position of the text
+    :param y: the y position of the text
+    :param value: the text of the stat
+    :param font_path: path of the font file
+    """
+    with metrics.timer('generate.text_layout'):
+        font_size = fit_text(value, font_path, dpi(15.5), dpi(4))
+    canvas.text((x, y), value, font=load_font(font_path, font_size), fill=(0, 0, 0))
+
+
 def add_boxes(canvas, start_left, start_top, end_right, box_height, step, box_count, color):
     """
     Add boxes to the canvas
@@ -243,12 +763,16 @@ def load_sized_image(image_path, max_width, max_height):
     return img.resize((int(width * ratio), int(height * ratio)))
 
 
-def render_card_back(gen_config):
+def render_card_back(gen_config, save=True):
     """
     Render the card back
 
     :param gen_config: The configuration for the card back
+    :param save: save the card back, otherwise it is returned to be saved by the caller
+    :return: the card back if it was not saved and the metrics of rendering the card back
     """
+    before = metrics.snapshot()
+    start = perf_counter()
     print_width = dpi(gen_config['width'])
     print_height = dpi(gen_config['height'])
     cut_border = dpi(gen_config['cut_border'])
@@ -272,10 +796,16 @@ def render_card_back(gen_config):
                            radius=dpi(3), width=1, fill=0)
     card_back = Image.composite(card_back, back_image, mask)
 
+    metrics.add_time('generate.draw', perf_counter() - start)
+    if not save:
+        return card_back, metrics.since(before)
+
     # Safe back image to file
-    card_back_path = os.path.join(gen_config['cards_directory'], gen_config['card_back_file_name'])
-    card_back.save(card_back_path)
+    card_back_path = os.path.join(gen_config['cards_directory'], card_back_file_name())
+    with metrics.timer('generate.save'):
+        save_card(card_back, card_back_path, gen_config)
     print(f'Created card back in {card_back_path}')
+    return None, metrics.since(before)
 
 
 def dpi(length) -> int:
@@ -285,9 +815,13 @@ def dpi(length) -> int:
     :param length: input length in mm
     :return: pixel appropriation to the given dpi value
     """
-    dpi_value = int(config['generate']['dpi'])
-    return int(float(length) * (dpi_value / CONVERSION_IN_MM))
+    return _dpi(length, config['generate']['dpi'])
+
+
+@functools.lru_cache(maxsize=None)
+def _dpi(length, dpi_value):
+    return int(float(length) * (int(dpi_value) / CONVERSION_IN_MM))
 
 
 if __name__ == '__main__':
-    generate_cards()
+    exit(1 if metrics.run_main(generate_cards, 'Render the cards of the selection') else 0)
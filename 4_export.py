@@ -0,0 +1,227 @@
+import importlib
+import os
+import queue
+import threading
+
+from PIL import Image, ImageDraw
+
+import metrics
+from settings import config
+
+# Sheet sizes in mm as width and height in portrait orientation
+SHEET_SIZES = {
+    'A4': (210, 297),
+    'A3': (297, 420),
+    'SRA3': (320, 450),
+    'letter': (215.9, 279.4),
+}
+
+generate = importlib.import_module('3_generate')
+dpi = generate.dpi
+
+
+def sheet_size(sheet):
+    """
+    Get the size of a sheet in pixel
+
+    :param sheet: name of a sheet size or width and height in mm
+    """
+    width, height = SHEET_SIZES[sheet] if isinstance(sheet, str) else sheet
+    return dpi(width), dpi(height)
+
+
+def sheet_layout(sheet_width, sheet_height, card_width, card_height, margin):
+    """
+    Find the grid placing the most cards on a sheet, the sheet is turned to landscape if more cards fit
+
+    :param sheet_width: width of the sheet in portrait orientation in pixel
+    :param sheet_height: height of the sheet in portrait orientation in pixel
+    :param card_width: width of a card including the bleed in pixel
+    :param card_height: height of a card including the bleed in pixel
+    :param margin: minimum margin around the cards in pixel
+    :return: the sheet size, number of columns and rows and the offset of the centered grid
+    """
+    layouts = []
+    for width, height in ((sheet_width, sheet_height), (sheet_height, sheet_width)):
+        columns = (width - 2 * margin) // card_width
+        rows = (height - 2 * margin) // card_height
+        layouts.append((columns * rows, (width, height), columns, rows))
+    count, size, columns, rows = max(layouts, key=lambda layout: layout[0])
+    if count == 0:
+        raise ValueError('The cards do not fit on the sheet, use a larger sheet or a smaller margin')
+    offset = ((size[0] - columns * card_width) // 2, (size[1] - rows * card_height) // 2)
+    return size, columns, rows, offset
+
+
+def add_crop_marks(canvas, columns, rows, offset, card_width, card_height, bleed):
+    """
+    Draw crop marks at the trim lines of the cards into the margin around the grid
+
+    :param canvas: the drawing context of the sheet
+    :param columns: number of columns of the grid
+    :param rows: number of rows of the grid
+    :param offset: position of the top left corner of the grid
+    :param card_width: width of a card including the bleed
+    :param card_height: height of a card including the bleed
+    :param bleed: width of the bleed around each card
+    """
+    gap = dpi(1)
+    length = dpi(4)
+    left, top = offset
+    right, bottom = left + columns * card_width, top + rows * card_height
+    for column in range(columns):
+        for x in (left + column * card_width + bleed, left + (column + 1) * card_width - bleed):
+            canvas.line((x, top - gap - length, x, top - gap), fill=(0, 0, 0), width=1)
+            canvas.line((x, bottom + gap, x, bottom + gap + length), fill=(0, 0, 0), width=1)
+    for row in range(rows):
+        for y in (top + row * card_height + bleed, top + (row + 1) * card_height - bleed):
+            canvas.line((left - gap - length, y, left - gap, y), fill=(0, 0, 0), width=1)
+            canvas.line((right + gap, y, right + gap + length, y), fill=(0, 0, 0), width=1)
+
+
+def impose_sheets(card_paths, back_path=None):
+    """
+    Place the cards onto sheets, only the cards of the current sheet are loaded at a time
+
+    :param card_paths: paths of the card images in print order
+    :param back_path: optional card back, a mirrored page of backs follows each page for double-sided printing
+    :return: generator of the sheets converted to the output color mode
+    """
+    export_config = config['export']
+    gen_config = config['generate']
+    card_width = dpi(gen_config['width']) + 2 * dpi(gen_config['cut_border'])
+    card_height = dpi(gen_config['height']) + 2 * dpi(gen_config['cut_border'])
+    sheet_width, sheet_height = sheet_size(export_config['sheet'])
+    size, columns, rows, offset = sheet_layout(sheet_width, sheet_height, card_width, card_height,
+                                               dpi(export_config['margin']))
+    per_sheet = columns * rows
+    color_mode = gen_config.get('color_mode') or 'RGB'
+
+    def new_sheet(count):
+        sheet = Image.new('RGB', size, color=(255, 255, 255))
+        if export_config.get('crop_marks', True):
+            add_crop_marks(ImageDraw.Draw(sheet), columns, (count + columns - 1) // columns, offset,
+                           card_width, card_height, dpi(gen_config['cut_border']))
+        return sheet
+
+    def position(slot, mirrored=False):
+        column, row = slot % columns, slot // columns
+        if mirrored:
+            column = columns - 1 - column
+        return offset[0] + column * card_width, offset[1] + row * card_height
+
+    for start in range(0, len(card_paths), per_sheet):
+        paths = card_paths[start:start + per_sheet]
+        sheet = new_sheet(len(paths))
+        for slot, path in enumerate(paths):
+            with metrics.timer('export.load_card'), Image.open(path) as card:
+                card = card.convert('RGB')
+            if card.size != (card_width, card_height):
+                card = card.resize((card_width, card_height))
+            sheet.paste(card, position(slot))
+        # Convert once per sheet, the cards are rendered in RGB
+        with metrics.timer('export.convert'):
+            sheet = sheet.convert(color_mode)
+        yield sheet
+        if back_path is not None:
+            sheet = new_sheet(len(paths))
+            with Image.open(back_path) as back:
+                back = back.convert('RGB').resize((card_width, card_height))
+            for slot in range(len(paths)):
+                sheet.paste(back, position(slot, mirrored=True))
+            with metrics.timer('export.convert'):
+                sheet = sheet.convert(color_mode)
+            yield sheet
+
+
+def prefetch(items, size=1):
+    """
+    Produce the items of an iterable in a background thread, ahead of the consumer
+    Image decoding and encoding release the GIL, so the next sheet is imposed while a page is written
+
+    :param items: the iterable to consume
+    :param size: number of items produced ahead
+    :return: generator of the items
+    """
+    buffer = queue.Queue(maxsize=size)
+    done = object()
+    errors = []
+
+    def produce():
+        try:
+            for item in items:
+                buffer.put(item)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            buffer.put(done)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    while (item := buffer.get()) is not done:
+        yield item
+    thread.join()
+    if errors:
+        raise errors[0]
+
+
+def write_pdf(sheets, pdf_path):
+    """
+    Write sheets into a multi-page PDF, each page is appended to the file once it is ready
+
+    :param sheets: iterable of the sheets
+    :param pdf_path: path of the PDF file
+    :return: number of pages
+    """
+    temp_path = f'{pdf_path}.{os.getpid()}.tmp'
+    resolution = float(config['generate']['dpi'])
+    quality = config['export'].get('quality', 95)
+    pages = 0
+    try:
+        for sheet in sheets:
+            with metrics.timer('export.write_page'):
+                sheet.save(temp_path, 'PDF', append=pages > 0, resolution=resolution, quality=quality)
+            pages += 1
+            print(f'Wrote page {pages} of {pdf_path}')
+        if pages:
+            os.replace(temp_path, pdf_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return pages
+
+
+def export_cards(card_selection=None):
+    """
+    Export the rendered cards of the selection as print sheets in a PDF
+
+    :param card_selection: card data to export, defaults to the cards of the selection file
+    :return: list of the cards missing in the cards directory
+    """
+    gen_config = config['generate']
+    export_config = config['export']
+    card_paths = []
+    missing = []
+    for card_data in generate.load_selection(card_selection):
+        card_path = os.path.join(gen_config['cards_directory'], generate.card_file_name(card_data))
+        if os.path.exists(card_path):
+            card_paths.append(card_path)
+        else:
+            missing.append(f'{card_data["group"]}{card_data["index"]} {card_data["name"]}')
+    back_path = None
+    if export_config.get('backs', True):
+        back_path = os.path.join(gen_config['cards_directory'], generate.card_back_file_name())
+        if not os.path.exists(back_path):
+            missing.append('card back')
+            back_path = None
+
+    pdf_path = os.path.join(gen_config['cards_directory'], export_config['file_name'])
+    pages = write_pdf(prefetch(impose_sheets(card_paths, back_path)), pdf_path)
+    print(f'Exported {len(card_paths)} cards on {pages} pages to {pdf_path}')
+    if missing:
+        print(f'\n{len(missing)} cards are missing, run 3_generate.py first: {", ".join(missing)}')
+    return missing
+
+
+if __name__ == '__main__':
+    exit(1 if metrics.run_main(export_cards, 'Export the cards as print sheets into a PDF') else 0)
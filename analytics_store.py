@@ -0,0 +1,229 @@
+"""
+Normalized database of the collection for analysis
+The games are stored with their categories, mechanics and player count poll in indexed tables, so large
+collections can be queried and filtered with SQL. The wide collection.csv is derived from the collection_csv view.
+Run this file to rebuild the database and the CSV from the snapshot of the last fetch.
+"""
+import csv
+import os
+import sqlite3
+
+import metrics
+
+SCHEMA = '''
+CREATE TABLE games (
+    position INTEGER PRIMARY KEY,
+    id TEXT NOT NULL,
+    name TEXT,
+    image TEXT,
+    year INTEGER,
+    min_players INTEGER,
+    max_players INTEGER,
+    min_playtime INTEGER,
+    max_playtime INTEGER,
+    age INTEGER,
+    rank INTEGER,
+    average REAL,
+    bayes_average REAL,
+    weight REAL,
+    owned INTEGER,
+    users_rated INTEGER,
+    user_rating TEXT,
+    numplays INTEGER
+);
+CREATE TABLE categories (
+    id TEXT PRIMARY KEY,
+    name TEXT
+);
+CREATE TABLE game_categories (
+    category_id TEXT NOT NULL,
+    game_id TEXT NOT NULL,
+    PRIMARY KEY (category_id, game_id)
+) WITHOUT ROWID;
+CREATE TABLE game_mechanics (
+    mechanic TEXT NOT NULL,
+    game_id TEXT NOT NULL,
+    PRIMARY KEY (mechanic, game_id)
+) WITHOUT ROWID;
+CREATE TABLE suggested_players (
+    game_id TEXT NOT NULL,
+    numplayers TEXT NOT NULL,
+    best INTEGER NOT NULL,
+    recommended INTEGER NOT NULL,
+    not_recommended INTEGER NOT NULL,
+    PRIMARY KEY (game_id, numplayers)
+) WITHOUT ROWID;
+CREATE INDEX games_id ON games (id);
+CREATE INDEX games_rank ON games (rank);
+CREATE INDEX games_weight ON games (weight);
+CREATE INDEX game_categories_game ON game_categories (game_id);
+CREATE INDEX game_mechanics_game ON game_mechanics (game_id);
+'''
+
+# Columns of the collection.csv as column name and expression on the games table
+CSV_COLUMNS = [
+    ('id', 'g.id'),
+    ('name', 'g.name'),
+    ('rank', "COALESCE(g.rank, 'Not Ranked')"),
+    ('yearpublished', 'g.year'),
+    ('minplayers', 'g.min_players'),
+    ('maxplayers', 'g.max_players'),
+    ('userrating', 'g.user_rating'),
+    ('numplays', 'g.numplays'),
+    ('minplaytime', 'g.min_playtime'),
+    ('maxplaytime', 'g.max_playtime'),
+    ('age', 'g.age'),
+    ('weight', 'g.weight'),
+    ('owned', 'g.owned'),
+    ('bgg_usersrated', 'g.users_rated'),
+    ('bgg_ratingavg', 'g.average'),
+    ('bgg_ratingbay', 'g.bayes_average'),
+    ('image', 'trim(g.image)'),
+]
+
+
+def quote(identifier):
+    """
+    Quote a column name for SQL
+    """
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def literal(value):
+    """
+    Quote a string value for SQL
+    """
+    return "'" + value.replace("'", "''") + "'"
+
+
+def csv_view(category_ids):
+    """
+    Build the view with one row per game and one c_<category> column per category, marked with x
+
+    :param category_ids: category ids with their names in the order of the columns
+    """
+    columns = [f'{expression} AS {quote(name)}' for name, expression in CSV_COLUMNS]
+    columns += [f"MAX(CASE WHEN gc.category_id = {literal(category_id)} THEN 'x' END) "
+                f"AS {quote(f'c_{name}')}" for category_id, name in category_ids.items()]
+    return (f'CREATE VIEW collection_csv AS SELECT {", ".join(columns)} FROM games AS g '
+            f'LEFT JOIN game_categories AS gc ON gc.game_id = g.id GROUP BY g.position ORDER BY g.position')
+
+
+def distinct_games(games):
+    """
+    Get each game once, a collection lists a game once per owned copy
+
+    :param games: the parsed games
+    """
+    return list({game.id: game for game in games}.values())
+
+
+def category_rows(games, category_ids):
+    """
+    Get the categories of the games and collect the names of the categories
+
+    :param games: the parsed games, each game once
+    :param category_ids: dict the category names are added to by id, in the order of their first appearance
+    :return: generator of category id and game id
+    """
+    for game in games:
+        for category_id, name in dict.fromkeys(zip(game.category_ids, game.categories)):
+            category_id = category_id or name
+            category_ids.setdefault(category_id, name)
+            yield category_id, game.id
+
+
+def write_database(path, games):
+    """
+    Write the games into a new database, replacing the previous one once it is complete
+
+    :param path: path of the database file
+    :param games: list of the parsed games in the order of the collection
+    """
+    temp_path = f'{path}.tmp'
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    connection = sqlite3.connect(temp_path)
+    try:
+        connection.execute('PRAGMA journal_mode=OFF')
+        connection.execute('PRAGMA synchronous=OFF')
+        connection.executescript(SCHEMA)
+        # Categories are ordered by their first appearance, like the columns of the CSV always were
+        category_ids = {}
+        with connection:
+            connection.executemany(
+                'INSERT INTO games VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                ((position, game.id, game.name, game.image, game.year, game.min_players, game.max_players,
+                  game.min_playtime, game.max_playtime, game.age, game.rank, game.average, game.bayes_average,
+                  game.weight, game.owned, game.users_rated, game.user_rating, game.numplays)
+                 for position, game in enumerate(games)))
+            # The game data is the same for every copy of a game, it is stored once per game
+            unique_games = distinct_games(games)
+            connection.executemany('INSERT INTO game_categories VALUES (?, ?)',
+                                   category_rows(unique_games, category_ids))
+            connection.executemany('INSERT INTO categories VALUES (?, ?)', category_ids.items())
+            connection.executemany('INSERT INTO game_mechanics VALUES (?, ?)',
+                                   ((mechanic, game.id) for game in unique_games
+                                    for mechanic in dict.fromkeys(game.mechanics)))
+            connection.executemany('INSERT INTO suggested_players VALUES (?, ?, ?, ?, ?)',
+                                   ((game.id, *results) for game in unique_games
+                                    for results in {results[0]: results for results in game.poll}.values()))
+            connection.execute(csv_view(category_ids))
+        connection.execute('ANALYZE')
+    finally:
+        connection.close()
+    os.replace(temp_path, path)
+
+
+def write_csv(database_path, csv_path):
+    """
+    Write the collection_csv view of a database as CSV file
+
+    :param database_path: path of the database file
+    :param csv_path: path of the CSV file
+    """
+    connection = sqlite3.connect(database_path)
+    try:
+        cursor = connection.execute('SELECT * FROM collection_csv')
+        with open(csv_path, 'w', encoding='UTF-8', newline='') as fp:
+            writer = csv.writer(fp)
+            writer.writerow(column[0] for column in cursor.description)
+            writer.writerows(cursor)
+    finally:
+        connection.close()
+
+
+def export(games, database_path, csv_path):
+    """
+    Write the database and the CSV file of the games
+
+    :param games: list of the parsed games in the order of the collection
+    :param database_path: path of the database file
+    :param csv_path: path of the CSV file
+    """
+    print(f'\nWriting result to database and CSV')
+    with metrics.timer('fetch.write_database'):
+        write_database(database_path, games)
+    with metrics.timer('fetch.write_csv'):
+        write_csv(database_path, csv_path)
+    print(f'Database written to {database_path}, CSV file written to {csv_path}')
+
+
+def export_snapshot():
+    """
+    Rebuild the database and the CSV file from the snapshot of the last fetch
+    """
+    from game_store import read_snapshot
+    from settings import config
+
+    collection_file_key = config['general']['collection_file_key']
+    cache_directory = config['general']['cache_directory']
+    games = read_snapshot(os.path.join(cache_directory, f'{collection_file_key}.snapshot'))
+    if games is None:
+        raise RuntimeError('No snapshot of the collection found, run 1_fetch.py first')
+    export(games, os.path.join(cache_directory, f'{collection_file_key}.sqlite'),
+           os.path.join(cache_directory, f'{collection_file_key}.csv'))
+
+
+if __name__ == '__main__':
+    metrics.run_main(export_snapshot, 'Rebuild the collection database and CSV from the last fetch')
@@ -0,0 +1,219 @@
+"""
+Store of cached API responses in a single SQLite database
+Responses are stored compressed with their fetch time and validators, keyed by the name of the response,
+e.g. 13.xml for the game with id 13. Run this file with migrate to import an existing file cache.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from time import time
+
+import metrics
+from http_client import conditional_headers, get, meta_is_fresh, read_meta
+
+DATABASE_NAME = 'responses.sqlite'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    body BLOB NOT NULL,
+    fetched_at REAL NOT NULL,
+    etag TEXT,
+    last_modified TEXT
+)
+'''
+
+# Keys looked up at once, stays below the limit of parameters of old SQLite versions
+CHUNK_SIZE = 500
+
+
+class ApiStore:
+    """
+    Cached API responses of one database, shared by the threads of a process
+    Other processes can use the same database, writes wait for each other
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path of the database file, created if missing
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def meta(self, key):
+        """
+        Get the cache metadata of a response
+
+        :param key: key of the response
+        :return: dict with fetched_at, etag and last_modified, None if the response is not stored
+        """
+        return self.meta_many([key]).get(key)
+
+    def meta_many(self, keys):
+        """
+        Get the cache metadata of several responses
+
+        :param keys: keys of the responses
+        :return: metadata by key, responses that are not stored are missing
+        """
+        result = {}
+        keys = list(keys)
+        with self.lock:
+            for start in range(0, len(keys), CHUNK_SIZE):
+                chunk = keys[start:start + CHUNK_SIZE]
+                rows = self.connection.execute(
+                    f'SELECT key, fetched_at, etag, last_modified FROM responses '
+                    f'WHERE key IN ({",".join("?" * len(chunk))})', chunk)
+                for key, fetched_at, etag, last_modified in rows:
+                    result[key] = {'fetched_at': fetched_at, 'etag': etag, 'last_modified': last_modified}
+        return result
+
+    def get(self, key):
+        """
+        Get the body of a response
+
+        :param key: key of the response
+        :return: the body, None if the response is not stored
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT body FROM responses WHERE key = ?', (key,)).fetchone()
+        return zlib.decompress(row[0]) if row is not None else None
+
+    def iter_bodies(self, keys, window=256):
+        """
+        Read the bodies of several responses with one query, in the order of the keys
+        Only a window of the bodies is read at a time
+
+        :param keys: keys of the responses
+        :param window: number of rows fetched at once
+        :return: generator of the key and body, None for responses that are not stored
+        """
+        with self.lock:
+            cursor = self.connection.execute(
+                'SELECT keys.value, responses.body FROM json_each(?) AS keys '
+                'LEFT JOIN responses ON responses.key = keys.value ORDER BY keys.key', (json.dumps(list(keys)),))
+        while True:
+            with self.lock:
+                rows = cursor.fetchmany(window)
+            if not rows:
+                return
+            for key, body in rows:
+                yield key, zlib.decompress(body) if body is not None else None
+
+    def put_many(self, entries):
+        """
+        Store several responses in one transaction
+
+        :param entries: iterable of key, body, fetched_at, etag and last_modified
+        """
+        rows = [(key, zlib.compress(body, 6), fetched_at, etag, last_modified)
+                for key, body, fetched_at, etag, last_modified in entries]
+        with self.lock, self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            self.connection.executemany('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)', rows)
+
+    def touch(self, key, fetched_at=None):
+        """
+        Mark a stored response as fetched now, used when the server reported it as not modified
+
+        :param key: key of the response
+        :param fetched_at: time of the fetch, defaults to now
+        """
+        with self.lock, self.connection:
+            self.connection.execute('UPDATE responses SET fetched_at = ? WHERE key = ?', (fetched_at or time(), key))
+
+    def delete_many(self, keys):
+        """
+        Remove several responses in one transaction
+
+        :param keys: keys of the responses
+        """
+        with self.lock, self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            self.connection.executemany('DELETE FROM responses WHERE key = ?', [(key,) for key in keys])
+
+    def fetch(self, url, key, name, ttl_days=None, **get_kwargs):
+        """
+        Make sure a fresh copy of an url is stored
+        Stale responses are revalidated with a conditional request and only downloaded again if changed
+
+        :param url: url to load
+        :param key: key of the response
+        :param name: name used in log messages
+        :param ttl_days: time to live in days, None to keep stored responses forever
+        :param get_kwargs: additional arguments for get
+        :return: True if the content was downloaded, False if the stored response was still valid
+        """
+        meta = self.meta(key)
+        if meta_is_fresh(meta, ttl_days):
+            metrics.count('cache.hit')
+            return False
+        response = get(url, name, headers=conditional_headers(meta), **get_kwargs)
+        if response.status_code == 304:
+            print(f'{name} not modified')
+            metrics.count('cache.not_modified')
+            self.touch(key)
+            return False
+        metrics.count('cache.miss')
+        self.put_many([(key, response.content, time(), response.headers.get('ETag'),
+                        response.headers.get('Last-Modified'))])
+        return True
+
+    def import_files(self, directory, delete=False):
+        """
+        Import the responses of a file cache, the fetch times and validators are kept
+
+        :param directory: directory of the cached files
+        :param delete: remove the files once they are imported
+        :return: number of imported responses
+        """
+        imported = 0
+        batch = []
+        for entry in os.scandir(directory):
+            if not entry.is_file() or not entry.name.endswith('.xml'):
+                continue
+            meta = read_meta(entry.path)
+            with open(entry.path, 'rb') as fp:
+                batch.append((entry.name, fp.read(), meta['fetched_at'], meta.get('etag'), meta.get('last_modified')))
+            if len(batch) == CHUNK_SIZE:
+                imported += self.import_batch(directory, batch, delete)
+        return imported + self.import_batch(directory, batch, delete)
+
+    def import_batch(self, directory, batch, delete):
+        self.put_many(batch)
+        if delete:
+            for key, *_ in batch:
+                path = os.path.join(directory, key)
+                os.remove(path)
+                if os.path.exists(f'{path}.meta'):
+                    os.remove(f'{path}.meta')
+        imported = len(batch)
+        batch.clear()
+        return imported
+
+
+if __name__ == '__main__':
+    from settings import config
+
+    parser = argparse.ArgumentParser(description='Manage the store of cached API responses')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate = subparsers.add_parser('migrate', help='import the cached XML files of the api cache directory')
+    migrate.add_argument('--delete', action='store_true', help='remove the files once they are imported')
+    args = parser.parse_args()
+
+    api_cache_path = os.path.join(config['general']['cache_directory'], config['general']['api_cache_directory'])
+    store = ApiStore(os.path.join(api_cache_path, DATABASE_NAME))
+    count = store.import_files(api_cache_path, delete=args.delete)
+    store.close()
+    print(f'Imported {count} responses from {api_cache_path} into {store.path}')
@@ -0,0 +1,135 @@
+"""
+Generate decks for many users in one run
+
+The users and their config overrides are read from a batch file, see batch-sample.yaml.
+Each user runs fetch, select, generate and export in a pool of processes, the API and image caches are shared
+and each process keeps its loaded modules and resources for the following users.
+"""
+import argparse
+import json
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
+
+import metrics
+from pipeline import STAGES, Pipeline
+from settings import config, load_config, merge_config, use_config
+
+
+def user_config(base_config, batch, entry):
+    """
+    Build the config of one user of the batch
+
+    :param base_config: the config all users start from
+    :param batch: the batch definition
+    :param entry: the batch entry of the user
+    """
+    output_directory = os.path.abspath(batch.get('output_directory') or 'batch')
+    shared_cache = os.path.abspath(batch.get('cache_directory') or os.path.join(output_directory, '_shared'))
+    user = entry['user']
+    user_directory = os.path.join(output_directory, user)
+    workers = batch.get('workers') or os.cpu_count()
+    merged = merge_config(base_config, batch.get('overrides'))
+    merged = merge_config(merged, {
+        'general': {
+            'cache_directory': os.path.join(user_directory, 'cache'),
+            # Absolute paths are used as is, so all users share the API and image caches
+            'api_cache_directory': os.path.join(shared_cache, merged['general']['api_cache_directory']),
+            'image_cache_directory': os.path.join(shared_cache, merged['general']['image_cache_directory']),
+            'derived_image_cache_directory': os.path.join(
+                shared_cache, merged['general'].get('derived_image_cache_directory', 'images-derived')),
+            # The collection listing is cached in the shared API cache and needs a name per user
+            'collection_file_key': f"{merged['general']['collection_file_key']}-{user}",
+        },
+        'fetch': {
+            'user': user,
+            # Every process has its own rate limiter, together they keep the configured rate
+            'requests_per_second': merged['fetch'].get('requests_per_second', 2) / workers,
+        },
+        'generate': {
+            'cards_directory': os.path.join(user_directory, 'cards'),
+            # Share the cores between the users rendered at the same time
+            'workers': merged['generate'].get('workers') or max(1, os.cpu_count() // workers),
+        },
+    })
+    return merge_config(merged, entry.get('overrides'))
+
+
+def run_user(user, user_values, stages):
+    """
+    Run the pipeline for one user, executed in a worker process
+
+    :param user: name of the user
+    :param user_values: the config of the user
+    :param stages: names of the stages to run
+    :return: report of the run with the time of each stage
+    """
+    use_config(user_values)
+    metrics.reset()
+    os.makedirs(user_values['general']['cache_directory'], exist_ok=True)
+    report = {'user': user, 'status': 'ok', 'error': None}
+    # The selection file is kept, so single stages can be run again for the user
+    pipeline = Pipeline(checkpoint=True)
+    for stage in STAGES:
+        if stage not in stages:
+            continue
+        start = perf_counter()
+        try:
+            failed = pipeline.run_stage(stage)
+            if failed:
+                report['status'] = f'failed in {stage}'
+                report['error'] = f'{len(failed)} failed: {", ".join(failed)}'
+                break
+        except (Exception, SystemExit) as e:
+            report['status'] = f'failed in {stage}'
+            report['error'] = ''.join(traceback.format_exception_only(type(e), e)).strip()
+            break
+        finally:
+            report[f'{stage}_seconds'] = round(perf_counter() - start, 3)
+    report['metrics'] = metrics.snapshot()
+    return report
+
+
+def run_batch(batch_file, stages):
+    """
+    Run the pipeline for all users of a batch file and write a summary report
+
+    :param batch_file: path of the batch definition
+    :param stages: names of the stages to run
+    :return: list of reports per user
+    """
+    batch = load_config(batch_file)
+    output_directory = os.path.abspath(batch.get('output_directory') or 'batch')
+    os.makedirs(output_directory, exist_ok=True)
+    base_config = dict(config)
+    start = perf_counter()
+    reports = []
+    with ProcessPoolExecutor(max_workers=batch.get('workers') or os.cpu_count()) as executor:
+        futures = [executor.submit(run_user, entry['user'], user_config(base_config, batch, entry), stages)
+                   for entry in batch['users']]
+        for future in as_completed(futures):
+            report = future.result()
+            print(f"Finished {report['user']}: {report['status']}")
+            reports.append(report)
+
+    summary = {'total_seconds': round(perf_counter() - start, 3), 'users': reports}
+    report_path = os.path.join(output_directory, 'report.json')
+    with open(report_path, 'w', encoding='utf-8') as fp:
+        json.dump(summary, fp, indent=2)
+
+    print(f'\n{"user":<20} {"status":<20}' + ''.join(f' {stage:>9}' for stage in stages))
+    for report in reports:
+        print(f"{report['user']:<20} {report['status']:<20}"
+              + ''.join(f" {report.get(f'{stage}_seconds', 0):>9.2f}" for stage in stages))
+    print(f"\nProcessed {len(reports)} users in {summary['total_seconds']:.2f} seconds, report written to {report_path}")
+    return reports
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate decks for many users')
+    parser.add_argument('batch_file', help='yaml file listing the users and config overrides')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES, help='stages to run for each user')
+    args = parser.parse_args()
+    failed = [report for report in run_batch(args.batch_file, args.stages) if report['status'] != 'ok']
+    exit(1 if failed else 0)
@@ -0,0 +1,98 @@
+"""
+Benchmark exporting a deck as print sheets into a PDF
+
+Measures the wall time and the peak memory of 4_export.py for a large deck of synthetic cards, compared to
+converting every card to CMYK and saving all sheets at once. Each run is done in a fresh process, so its
+peak resident set size is not influenced by the others.
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+from time import perf_counter
+
+from PIL import Image, ImageDraw
+from ruamel import yaml
+
+from common import load_script, sample_config
+
+
+def write_cards(work_dir, count):
+    """
+    Write a selection and a rendered card for each of its games
+    """
+    export = load_script('4_export', work_dir, sample_config())
+    gen_config = export.config['generate']
+    card_size = (export.dpi(gen_config['width']) + 2 * export.dpi(gen_config['cut_border']),
+                 export.dpi(gen_config['height']) + 2 * export.dpi(gen_config['cut_border']))
+    os.makedirs('cache', exist_ok=True)
+    os.makedirs(gen_config['cards_directory'], exist_ok=True)
+    games = []
+    for index in range(count):
+        card = Image.effect_noise(card_size, 40 + index % 20).convert('RGB')
+        ImageDraw.Draw(card).rectangle((40, 40, card_size[0] - 40, 200), fill=(200, 40, 40))
+        game = {'_id': str(1000 + index), 'name': f'Game {index}'}
+        card.save(os.path.join(gen_config['cards_directory'], f'A{index}-{game["_id"]}.png'), compress_level=1)
+        games.append(game)
+    Image.effect_noise(card_size, 60).convert('RGB').save(
+        os.path.join(gen_config['cards_directory'], gen_config['card_back_file_name']))
+    groups = {'A': {'category': 'Synthetic', 'color': '#F44336', 'top-color': '#c62828', 'games': games}}
+    with open(os.path.join('cache', 'selection.yaml'), 'w', encoding='utf-8') as fp:
+        yaml.safe_dump({'groups': groups}, fp)
+
+
+def all_at_once(export):
+    """
+    Reference export, every card is converted on its own and all sheets are kept until the PDF is saved
+    """
+    gen_config = export.config['generate']
+    selection = export.generate.get_selection(os.path.join('cache', 'selection.yaml'))
+    paths = [os.path.join(gen_config['cards_directory'], export.generate.card_file_name(card_data))
+             for card_data in selection]
+    cards = [Image.open(path).convert(gen_config['color_mode']) for path in paths]
+    width, height = export.sheet_size(export.config['export']['sheet'])
+    size, columns, rows, offset = export.sheet_layout(width, height, cards[0].width, cards[0].height,
+                                                      export.dpi(export.config['export']['margin']))
+    sheets = []
+    for start in range(0, len(cards), columns * rows):
+        sheet = Image.new(gen_config['color_mode'], size, color=(0, 0, 0, 0))
+        for slot, card in enumerate(cards[start:start + columns * rows]):
+            sheet.paste(card, (offset[0] + slot % columns * card.width, offset[1] + slot // columns * card.height))
+        sheets.append(sheet)
+    sheets[0].save('reference.pdf', 'PDF', save_all=True, append_images=sheets[1:],
+                   resolution=float(gen_config['dpi']), quality=export.config['export']['quality'])
+
+
+def measure(work_dir, variant, results):
+    export = load_script('4_export', work_dir, sample_config(export={'backs': False}))
+    start = perf_counter()
+    if variant == 'streamed':
+        export.export_cards()
+    else:
+        all_at_once(export)
+    # ru_maxrss is reported in kilobytes on Linux
+    results.put((variant, perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+def run(count):
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as work_dir:
+        process = context.Process(target=write_cards, args=(work_dir, count))
+        process.start()
+        process.join()
+        results = context.Queue()
+        print(f'{"export of " + str(count) + " cards":<28} {"wall s":>9} {"peak MB":>9}')
+        for variant in ('all at once', 'streamed'):
+            process = context.Process(target=measure, args=(work_dir, variant, results))
+            process.start()
+            name, seconds, peak = results.get()
+            process.join()
+            print(f'{name:<28} {seconds:>9.2f} {peak:>9.0f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=500, help='number of cards in the deck')
+    args = parser.parse_args()
+    run(args.count)
@@ -0,0 +1,54 @@
+"""
+Benchmark the fetch stage against the local stand-in API
+
+Measures wall time, requests and throttled answers of a cold fetch for several worker counts.
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+from time import perf_counter
+
+from common import load_script, sample_config
+from stub_server import StubApi, start_server
+
+
+def run(size, workers, requests_per_second, latency, server_rate_limit):
+    api = StubApi(size, latency=latency, rate_limit=server_rate_limit)
+    server = start_server(api)
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            config = sample_config(fetch={
+                'user': 'bench',
+                'api_url': server.api_url,
+                'workers': workers,
+                'requests_per_second': requests_per_second,
+                'retry_backoff': 0.1,
+            })
+            fetch = load_script('1_fetch', work_dir, config)
+            start = perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                fetch.get_collection()
+            elapsed = perf_counter() - start
+            os.chdir(os.path.dirname(work_dir))
+    finally:
+        server.shutdown()
+    return elapsed, api
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=200, help='number of games in the collection')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--requests-per-second', type=float, default=50)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per stub response')
+    parser.add_argument('--server-rate-limit', type=float, default=None, help='requests per second before 429')
+    args = parser.parse_args()
+
+    print(f'{"workers":>8} {"seconds":>8} {"req/s":>8} {"requests":>9} {"throttled":>9}')
+    for worker_count in args.workers:
+        seconds, stats = run(args.size, worker_count, args.requests_per_second, args.latency,
+                             args.server_rate_limit)
+        print(f'{worker_count:>8} {seconds:>8.2f} {stats.requests / seconds:>8.1f} '
+              f'{stats.requests:>9} {stats.throttled:>9}')
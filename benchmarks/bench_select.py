@@ -0,0 +1,112 @@
+"""
+Benchmark the selection criteria on a synthetic collection
+
+Compares the XPath lookups on the XML elements with the game records parsed once at load time,
+and checks that the heap based select_games() picks the same games as a full sort, ties included.
+"""
+import argparse
+import os
+import tempfile
+from time import perf_counter
+
+from common import load_script, sample_config
+from synthetic import write_merged_collection
+
+
+def xpath_rank(x):
+    rank_str = x.find('./boardgame/statistics/ratings/ranks/rank[@name="boardgame"]').get('value')
+    return 100000 if rank_str == 'Not Ranked' else int(rank_str)
+
+
+def xpath_best_for_two(x):
+    max_players = int(x.find('stats').get('maxplayers'))
+    rating = float(x.find('./boardgame/statistics/ratings/average').text)
+    if max_players == 1:
+        return 100000
+    poll = x.find('./boardgame/poll[@name="suggested_numplayers"]/results[@numplayers="2"]')
+    best = int(poll.find('result[@value="Best"]').get('numvotes'))
+    rec = int(poll.find('result[@value="Recommended"]').get('numvotes'))
+    not_rec = int(poll.find('result[@value="Not Recommended"]').get('numvotes'))
+    total = best + rec + not_rec
+    best_percentage = 0 if total == 0 else best / total
+    return best_percentage * -1 - (rating / 10) + (max_players / 10)
+
+
+def xpath_best_for_many(x):
+    max_players = int(x.find('stats').get('maxplayers'))
+    rating = float(x.find('./boardgame/statistics/ratings/average').text)
+    return max_players * -1 - (rating / 10)
+
+
+def xpath_user_played_often(x):
+    plays = float(x.find('./numplays').text)
+    rating = float(x.find('./boardgame/statistics/ratings/average').text)
+    return plays * -1 - (rating / 10)
+
+
+def timed(function, *args):
+    start = perf_counter()
+    result = function(*args)
+    return result, perf_counter() - start
+
+
+def sorted_selection(criteria, games, number_of_cards):
+    """
+    Reference selection, fully sorting the games and removing the selected ones from the list
+    """
+    selected = sorted(games, key=criteria)[:number_of_cards]
+    for game in selected:
+        games.remove(game)
+    return [game.id for game in selected]
+
+
+def compare_selection(select, games, number_of_cards):
+    """
+    Select four sets with the reference and with select_games() and compare the results
+    """
+    criteria = [select.by_rank, select.by_best_for_two, select.by_best_for_many, select.by_user_played_often]
+    remaining = list(games)
+    expected, sort_time = timed(lambda: [sorted_selection(c, remaining, number_of_cards) for c in criteria])
+    selected_ids = set()
+    actual, heap_time = timed(lambda: [[entry['_id'] for entry in select.select_games(c, games, number_of_cards,
+                                                                                      selected_ids)]
+                                       for c in criteria])
+    assert actual == expected, f'select_games differs from a full sort for {number_of_cards} cards per set'
+    print(f'{"select " + str(number_of_cards) + " per set":<24} {sort_time:>9.3f} {heap_time:>9.3f} '
+          f'{sort_time / heap_time:>7.1f}x (sort and remove / heap, same result)')
+
+
+def run(size, sets):
+    with tempfile.TemporaryDirectory() as work_dir:
+        select = load_script('2_select', work_dir, sample_config())
+        os.makedirs('cache')
+        write_merged_collection(os.path.join('cache', 'collection.xml'), size)
+        from collection_stream import iter_items
+
+        items, xpath_load = timed(lambda: list(iter_items(os.path.join('cache', 'collection.xml'))))
+        games, store_load = timed(select.load_collection)
+
+        criteria = [(xpath_rank, select.by_rank), (xpath_best_for_two, select.by_best_for_two),
+                    (xpath_best_for_many, select.by_best_for_many),
+                    (xpath_user_played_often, select.by_user_played_often)]
+        print(f'{"criterion":<24} {"xpath s":>9} {"store s":>9} {"speedup":>8}')
+        for xpath_criterion, store_criterion in criteria:
+            xpath_order, xpath_time = timed(lambda: [sorted(items, key=xpath_criterion) for _ in range(sets)])
+            store_order, store_time = timed(lambda: [sorted(games, key=store_criterion) for _ in range(sets)])
+            assert [x.get('objectid') for x in xpath_order[0]] == [x.id for x in store_order[0]]
+            print(f'{store_criterion.__name__:<24} {xpath_time:>9.3f} {store_time:>9.3f} '
+                  f'{xpath_time / store_time:>7.1f}x')
+        print(f'{"load collection":<24} {xpath_load:>9.3f} {store_load:>9.3f}')
+        select.config['select']['replace_names'] = {}
+        # Large sets reach the games that are not ranked, which all share the same value
+        for number_of_cards in (13, size // 5, size * 9 // 10):
+            compare_selection(select, games, number_of_cards)
+        os.chdir(os.path.dirname(work_dir))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=10000, help='number of games in the collection')
+    parser.add_argument('--sets', type=int, default=4, help='number of sorts per criterion')
+    args = parser.parse_args()
+    run(args.size, args.sets)
@@ -0,0 +1,180 @@
+"""
+Benchmark suite covering fetch, select and generate on synthetic collections
+
+For each collection size the suite fetches the collection from the local stand-in API, loads it, evaluates
+every selection criterion, selects the sets and renders cards with synthetic artwork. The results are written
+to a JSON file, which can be given as baseline to a later run to compare the timings.
+
+    python bench_suite.py --sizes 10 1000 20000 --save results/before.json
+    python bench_suite.py --sizes 10 1000 20000 --baseline results/before.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+from time import perf_counter
+
+from common import REPO_ROOT, load_script, sample_config
+from stub_server import StubApi, start_server
+from synthetic import write_icons
+
+CRITERIA = ['by_rank', 'by_best_for_two', 'by_best_for_many', 'by_user_played_often']
+
+
+def measure(function, repeat):
+    """
+    Run a function several times without its output
+
+    :return: the seconds of each run
+    """
+    times = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = perf_counter()
+            function()
+            times.append(perf_counter() - start)
+    return times
+
+
+def suite_config(api_url):
+    """
+    Config for the runs of the suite, the fonts and card back are read from the repository
+    """
+    return sample_config(
+        fetch={'user': 'bench', 'api_url': api_url, 'workers': 8, 'requests_per_second': 1000,
+               'retry_backoff': 0.01},
+        select={'replace_names': {}},
+        generate={'font_main': os.path.join(REPO_ROOT, 'resources', 'FallingSky-JKwK.otf'),
+                  'font_heading': os.path.join(REPO_ROOT, 'resources', 'SourceSansPro-Regular.ttf'),
+                  'card_back_image': os.path.join(REPO_ROOT, 'resources', 'card_back.jpg')},
+    )
+
+
+def run_size(size, repeat, cards):
+    """
+    Run all benchmarks for one collection size
+
+    :return: list of results with case, size and the seconds of each run
+    """
+    results = []
+
+    def record(case, times):
+        results.append({'case': case, 'size': size, 'times': times})
+        print(f'{case:<28} {size:>7} {min(times):>10.4f} {statistics.median(times):>10.4f}')
+
+    server = start_server(StubApi(size, latency=0, collection_delay=0))
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            config = suite_config(server.api_url)
+
+            # Every fetch starts with an empty cache in its own directory
+            fetch_dirs = iter(os.path.join(work_dir, f'fetch-{index}') for index in range(repeat))
+            fetch_times = []
+            for fetch_dir in fetch_dirs:
+                fetch = load_script('1_fetch', fetch_dir, config)
+                fetch_times += measure(fetch.get_collection, 1)
+            record('get_collection', fetch_times)
+
+            select = load_script('2_select', os.path.join(work_dir, 'fetch-0'), config)
+            snapshot = os.path.join('cache', 'collection.snapshot')
+            xml_times = []
+            for _ in range(repeat):
+                os.remove(snapshot)
+                xml_times += measure(select.load_collection, 1)
+            record('load_collection xml', xml_times)
+            record('load_collection snapshot', measure(select.load_collection, repeat))
+
+            games = select.load_collection()
+            for name in CRITERIA:
+                criterion = getattr(select, name)
+                record(name, measure(lambda: [criterion(game) for game in games], repeat))
+            games_per_set = config['select']['games_per_set']
+            record('select_games', measure(
+                lambda: select.select_games(select.by_rank, games, games_per_set, set()), repeat))
+            record('select_collection', measure(select.select_collection, repeat))
+
+            generate = load_script('3_generate', os.path.join(work_dir, 'fetch-0'), config)
+            write_icons('resources', [icon[0] for icon in generate.ICONS])
+            selection = generate.get_selection(os.path.join('cache', 'selection.yaml'))[:cards]
+            os.makedirs(config['generate']['cards_directory'], exist_ok=True)
+            os.makedirs(os.path.join('cache', config['general']['image_cache_directory']), exist_ok=True)
+
+            def render():
+                for card_data in selection:
+                    generate.render_as_card(card_data, config['generate'])
+
+            # The first run downloads the artwork and fills the resized image cache
+            record('render_as_card cold', [time / len(selection) for time in measure(render, 1)])
+            record('render_as_card warm', [time / len(selection) for time in measure(render, repeat)])
+            os.chdir(os.path.dirname(work_dir))
+    finally:
+        server.shutdown()
+    return results
+
+
+def environment():
+    """
+    Describe the machine and the code the suite runs on
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'platform': platform.platform(),
+            'cpus': os.cpu_count()}
+
+
+def compare(results, baseline_path, threshold):
+    """
+    Compare the fastest run of each case with a baseline
+
+    :param results: results of this run
+    :param baseline_path: path of the results of an earlier run
+    :param threshold: relative slowdown reported as regression
+    :return: number of regressions
+    """
+    with open(baseline_path, 'r', encoding='utf-8') as fp:
+        baseline = json.load(fp)
+    previous = {(result['case'], result['size']): min(result['times']) for result in baseline['results']}
+    print(f'\nCompared to {baseline_path} (commit {baseline["environment"]["commit"]})')
+    print(f'{"case":<28} {"size":>7} {"baseline s":>10} {"current s":>10} {"ratio":>7}')
+    regressions = 0
+    for result in results:
+        key = (result['case'], result['size'])
+        if key not in previous:
+            continue
+        ratio = min(result['times']) / previous[key] if previous[key] else 1
+        slower = ratio > 1 + threshold
+        regressions += slower
+        print(f'{key[0]:<28} {key[1]:>7} {previous[key]:>10.4f} {min(result["times"]):>10.4f} {ratio:>6.2f}x'
+              + (' slower' if slower else ''))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000], help='numbers of games, up to 20000')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case, the fastest run is compared')
+    parser.add_argument('--cards', type=int, default=10, help='number of cards rendered per run')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON file of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative slowdown reported as regression')
+    args = parser.parse_args()
+
+    print(f'{"case":<28} {"size":>7} {"min s":>10} {"median s":>10}')
+    all_results = []
+    for collection_size in args.sizes:
+        all_results += run_size(collection_size, args.repeat, args.cards)
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w', encoding='utf-8') as fp:
+            json.dump({'environment': environment(), 'sizes': args.sizes, 'results': all_results}, fp, indent=2)
+        print(f'\nResults written to {args.save}')
+    if args.baseline and compare(all_results, args.baseline, args.threshold):
+        exit(1)
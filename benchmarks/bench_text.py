@@ -0,0 +1,89 @@
+"""
+Benchmark fitting the game names into the name box of a card
+
+Compares shrinking the font in 0.2mm steps, loading a font for every step, with the binary search
+over cached measurements used by 3_generate.py. The names are read from a collection.csv written
+by 1_fetch.py or generated, with some long names to force several steps.
+"""
+import argparse
+import csv
+import os
+import random
+import tempfile
+from time import perf_counter
+
+from PIL import Image, ImageDraw, ImageFont
+
+from common import REPO_ROOT, load_script, sample_config
+from synthetic import WORDS
+
+
+def synthetic_names(count, seed=0):
+    rng = random.Random(seed)
+    return [' '.join(rng.choices(WORDS, k=rng.choice([1, 2, 2, 3, 3, 4, 6, 8]))) for _ in range(count)]
+
+
+def csv_names(path):
+    with open(path, 'r', encoding='utf-8') as fp:
+        return [row['name'] for row in csv.DictReader(fp) if row.get('name')]
+
+
+def shrink_loop(name, font_path, dpi):
+    """
+    Reference implementation, the font size is reduced by 0.2mm until the name fits
+    """
+    d = ImageDraw.Draw(Image.new('RGB', (1, 1)))
+    font_size = 4.8
+    fnt = ImageFont.truetype(font_path, dpi(font_size))
+    _, _, text_width, _ = d.textbbox((0, 0), name, font=fnt)
+    while text_width > dpi(47.5):
+        font_size -= 0.2
+        fnt = ImageFont.truetype(font_path, dpi(font_size))
+        _, _, text_width, _ = d.textbbox((0, 0), name, font=fnt)
+    return dpi(font_size)
+
+
+def run(names, font_path, repeat):
+    with tempfile.TemporaryDirectory() as work_dir:
+        generate = load_script('3_generate', work_dir, sample_config())
+        dpi = generate.dpi
+
+        def fitted():
+            return [generate.fit_text(name, font_path, dpi(47.5), dpi(4.8)) for name in names]
+
+        start = perf_counter()
+        expected = [shrink_loop(name, font_path, dpi) for name in names]
+        loop_time = perf_counter() - start
+
+        start = perf_counter()
+        sizes = fitted()
+        cold_time = perf_counter() - start
+        start = perf_counter()
+        for _ in range(repeat):
+            fitted()
+        warm_time = (perf_counter() - start) / repeat
+
+        # Integer pixel sizes are searched, so names may get a slightly larger font than in 0.2mm steps
+        assert all(size >= reference for size, reference in zip(sizes, expected))
+        larger = sum(size > reference for size, reference in zip(sizes, expected))
+        print(f'{"names":<28} {len(names):>9}')
+        print(f'{"shrink loop s":<28} {loop_time:>9.3f}')
+        print(f'{"binary search cold s":<28} {cold_time:>9.3f} {loop_time / cold_time:>7.1f}x')
+        print(f'{"binary search warm s":<28} {warm_time:>9.3f} {loop_time / warm_time:>7.1f}x')
+        print(f'{"names with a larger font":<28} {larger:>9}')
+
+        wrapped = [generate.layout_text(name, font_path, dpi(47.5), dpi(4.8), wrap=True, max_height=dpi(4))
+                   for name in names]
+        print(f'{"names wrapped on two lines":<28} {sum(len(lines) > 1 for _, lines in wrapped):>9}')
+        os.chdir(os.path.dirname(work_dir))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--csv', help='collection.csv to read the names from')
+    parser.add_argument('--count', type=int, default=2000, help='number of synthetic names')
+    parser.add_argument('--repeat', type=int, default=5, help='repetitions with warm caches')
+    parser.add_argument('--font', default=os.path.join(REPO_ROOT, sample_config()['generate']['font_heading']),
+                        help='font used for the names')
+    args = parser.parse_args()
+    run(csv_names(args.csv) if args.csv else synthetic_names(args.count), os.path.abspath(args.font), args.repeat)
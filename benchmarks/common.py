@@ -0,0 +1,49 @@
+"""
+Helpers shared by the benchmarks
+"""
+import copy
+import importlib.util
+import os
+import sys
+
+from ruamel import yaml
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_CONFIG = os.path.join(REPO_ROOT, 'config-sample.yaml')
+
+
+def sample_config(**overrides):
+    """
+    Load the sample config and apply overrides given as section={key: value}
+    """
+    with open(SAMPLE_CONFIG, 'r', encoding='utf-8') as fp:
+        config = yaml.safe_load(fp)
+    for section, values in overrides.items():
+        config[section] = {**config.get(section, {}), **copy.deepcopy(values)}
+    return config
+
+
+def load_script(script_name, work_dir, config):
+    """
+    Import one of the numbered scripts with the given config inside a working directory
+    The scripts read config.yaml from the current directory, so the directory is changed permanently
+
+    :param script_name: name of the script without extension, e.g. 1_fetch
+    :param work_dir: directory used as working directory and for the config.yaml
+    :param config: config to write before importing
+    :return: the imported module
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    with open(os.path.join(work_dir, 'config.yaml'), 'w', encoding='utf-8') as fp:
+        yaml.safe_dump(config, fp)
+    os.chdir(work_dir)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    # The config is shared by all scripts of the process, replace it with the given one
+    import settings
+    settings.use_config(copy.deepcopy(config))
+    spec = importlib.util.spec_from_file_location(f'bench_{script_name}_{id(config)}',
+                                                  os.path.join(REPO_ROOT, f'{script_name}.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,126 @@
+"""
+Local stand-in for the BGG XML API serving synthetic responses and artwork
+
+Run standalone with `python benchmarks/stub_server.py --size 1500` and point `fetch.api_url`
+in the config.yaml to the printed address.
+"""
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep, monotonic
+from urllib.parse import urlparse
+
+import synthetic
+
+
+class StubApi:
+    """
+    State of the stand-in API, counts requests and throttles clients that are too fast
+    """
+
+    def __init__(self, size, latency=0.05, rate_limit=None, collection_delay=1, collection=None):
+        """
+        :param size: number of games in the synthetic collection
+        :param latency: seconds to wait before answering a request
+        :param rate_limit: requests per second accepted before answering with 429, None to disable
+        :param collection_delay: number of collection requests answered with 202 before the collection is ready
+        :param collection: XML of the collection listing, None for the synthetic listing of the given size
+        """
+        self.size = size
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.collection_delay = collection_delay
+        self.collection = collection
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.games_served = 0
+        self.images_served = 0
+        self.last_request = None
+
+    def throttle(self):
+        """
+        Check if the current request exceeds the rate limit
+        """
+        with self.lock:
+            self.requests += 1
+            now = monotonic()
+            too_fast = (self.rate_limit is not None and self.last_request is not None
+                        and now - self.last_request < 1 / self.rate_limit)
+            if too_fast:
+                self.throttled += 1
+            else:
+                self.last_request = now
+            return too_fast
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    api = None
+
+    def do_GET(self):
+        sleep(self.api.latency)
+        if self.api.throttle():
+            self.reply(429, 'Rate limit exceeded')
+            return
+        parts = urlparse(self.path).path.strip('/').split('/')
+        if len(parts) >= 3 and parts[-2] == 'collection':
+            with self.api.lock:
+                not_ready = self.api.collection_delay > 0
+                self.api.collection_delay -= 1
+            if not_ready:
+                self.reply(202, '<message>Your request for this collection has been accepted and will be '
+                                'processed.  Please try again later for access.</message>')
+            elif self.api.collection is not None:
+                self.reply(200, self.api.collection)
+            else:
+                self.reply(200, synthetic.collection_xml(self.api.size, image_root=f'http://{self.headers["Host"]}'))
+        elif len(parts) >= 3 and parts[-2] == 'boardgame':
+            ids = parts[-1].split(',')
+            with self.api.lock:
+                self.api.games_served += len(ids)
+            self.reply(200, synthetic.boardgames_xml(ids))
+        elif len(parts) == 2 and parts[0] == 'images':
+            with self.api.lock:
+                self.api.images_served += 1
+            self.reply(200, *synthetic.artwork(parts[1].split('.')[0]))
+        else:
+            self.reply(404, 'Not found')
+
+    def reply(self, status, body, content_type='text/xml; charset=utf-8'):
+        data = body.encode('utf-8') if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(api, port=0):
+    """
+    Start the stand-in server in a background thread
+
+    :param api: the StubApi state to serve
+    :param port: port to listen on, 0 picks a free port
+    :return: the server, its api root url is available as server.api_url
+    """
+    handler = type('BoundStubHandler', (StubHandler,), {'api': api})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    server.api_url = f'http://127.0.0.1:{server.server_address[1]}/xmlapi'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a synthetic BGG XML API')
+    parser.add_argument('--size', type=int, default=1500, help='number of games in the collection')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per response')
+    parser.add_argument('--rate-limit', type=float, default=None, help='requests per second before 429')
+    args = parser.parse_args()
+    stub = start_server(StubApi(args.size, args.latency, args.rate_limit), args.port)
+    print(f'Serving synthetic API on {stub.api_url}')
+    threading.Event().wait()
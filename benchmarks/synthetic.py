@@ -0,0 +1,207 @@
+"""
+Generator for synthetic BGG XML API responses and game artwork
+The responses mimic the structure of the real collection and boardgame endpoints
+"""
+import io
+import os
+import random
+from xml.sax.saxutils import escape
+
+from PIL import Image, ImageDraw
+
+CATEGORIES = [
+    (1002, 'Card Game'),
+    (1009, 'Abstract Strategy'),
+    (1015, 'Civilization'),
+    (1021, 'Economic'),
+    (1026, 'Negotiation'),
+    (1042, 'Expansion for Base-game'),
+    (1047, 'Miniatures'),
+    (1089, 'Animals'),
+]
+
+WORDS = ['Castle', 'Forest', 'Trade', 'Empire', 'River', 'Dice', 'Quest', 'Harbor', 'Star', 'Legend',
+         'Garden', 'Railway', 'Dragon', 'Market', 'Island', 'Tower', 'Crown', 'Voyage', 'Shadow', 'Guild']
+
+
+def game_id(index):
+    """
+    Id of the synthetic game with the given index
+    """
+    return 1000 + index
+
+
+def game_index(objectid):
+    """
+    Index of the synthetic game with the given id
+    """
+    return int(objectid) - 1000
+
+
+def game_name(rng, index):
+    return f'{rng.choice(WORDS)} {rng.choice(WORDS)} {index}'
+
+
+def collection_xml(size, seed=0, image_root='https://example.com'):
+    """
+    Render a collection listing with the given number of owned games
+
+    :param size: number of games in the collection
+    :param seed: seed for the random values
+    :param image_root: root of the image urls, e.g. the address of the stand-in server
+    """
+    items = []
+    for index in range(size):
+        rng = random.Random(seed * 1000003 + index)
+        objectid = game_id(index)
+        name = game_name(rng, index)
+        min_players = rng.randint(1, 3)
+        max_players = rng.randint(min_players, 8)
+        min_time = rng.choice([15, 30, 45, 60, 90])
+        max_time = min_time + rng.choice([0, 0, 30, 60])
+        rating = rng.choice(['N/A', str(rng.randint(1, 10))])
+        items.append(f'''  <item objecttype="thing" objectid="{objectid}" subtype="boardgame" collid="{index + 1}">
+    <name sortindex="1">{escape(name)}</name>
+    <yearpublished>{rng.randint(1980, 2023)}</yearpublished>
+    <image>{image_root}/images/{objectid}.jpg</image>
+    <thumbnail>{image_root}/thumbs/{objectid}.jpg</thumbnail>
+    <stats minplayers="{min_players}" maxplayers="{max_players}" minplaytime="{min_time}" maxplaytime="{max_time}" playingtime="{max_time}" numowned="{rng.randint(10, 90000)}">
+      <rating value="{rating}"/>
+    </stats>
+    <status own="1" prevowned="0" fortrade="0" want="0" wanttoplay="0" wanttobuy="0" wishlist="0" preordered="0" lastmodified="2022-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 10:00:00"/>
+    <numplays>{rng.choice([0, 0, 1, 2, 3, 5, 8, 13, 21])}</numplays>
+  </item>''')
+    return (f'<?xml version="1.0" encoding="utf-8" standalone="yes"?>\n'
+            f'<items totalitems="{size}" termsofuse="https://boardgamegeek.com/xmlapi/termsofuse">\n'
+            + '\n'.join(items) + '\n</items>\n')
+
+
+def boardgame_element(objectid, seed=0):
+    """
+    Render the boardgame element returned by the boardgame endpoint for one game
+
+    :param objectid: id of the game
+    :param seed: seed for the random values
+    """
+    index = game_index(objectid)
+    rng = random.Random(seed * 1000003 + index)
+    name = game_name(rng, index)
+    # Keep the same random sequence as the collection listing for consistent player counts
+    min_players = rng.randint(1, 3)
+    max_players = rng.randint(min_players, 8)
+    poll = []
+    for players in list(range(1, max_players + 1)) + [f'{max_players}+']:
+        poll.append(f'''      <results numplayers="{players}">
+        <result value="Best" numvotes="{rng.randint(0, 200)}"/>
+        <result value="Recommended" numvotes="{rng.randint(0, 200)}"/>
+        <result value="Not Recommended" numvotes="{rng.randint(0, 200)}"/>
+      </results>''')
+    categories = rng.sample(CATEGORIES[:5] + CATEGORIES[6:], 2)
+    # Some games are expansions, some are not ranked at all
+    if rng.random() < 0.1:
+        categories.append(CATEGORIES[5])
+    rank = 'Not Ranked' if rng.random() < 0.15 else str(index + 1)
+    return f'''  <boardgame objectid="{objectid}">
+    <yearpublished>{rng.randint(1980, 2023)}</yearpublished>
+    <minplayers>{min_players}</minplayers>
+    <maxplayers>{max_players}</maxplayers>
+    <age>{rng.choice([6, 8, 10, 12, 14])}</age>
+    <name primary="true" sortindex="1">{escape(name)}</name>
+    <description>{escape(name)} is a synthetic game. {' '.join(rng.choices(WORDS, k=80))}</description>
+{''.join(f'    <boardgamecategory objectid="{c_id}">{escape(c_name)}</boardgamecategory>{chr(10)}' for c_id, c_name in categories)}    <boardgamemechanic objectid="2001">Action Points</boardgamemechanic>
+    <poll title="User Suggested Number of Players" totalvotes="{rng.randint(0, 600)}" name="suggested_numplayers">
+{chr(10).join(poll)}
+    </poll>
+    <poll title="Language Dependence" totalvotes="0" name="language_dependence"></poll>
+    <comment username="someone">{' '.join(rng.choices(WORDS, k=30))}</comment>
+    <statistics page="1">
+      <ratings>
+        <usersrated>{rng.randint(10, 100000)}</usersrated>
+        <average>{rng.uniform(4, 9):.5f}</average>
+        <bayesaverage>{rng.uniform(4, 8):.5f}</bayesaverage>
+        <ranks>
+          <rank type="subtype" id="1" name="boardgame" friendlyname="Board Game Rank" value="{rank}" bayesaverage="0"/>
+        </ranks>
+        <stddev>1.5</stddev>
+        <median>0</median>
+        <owned>{rng.randint(10, 90000)}</owned>
+        <trading>0</trading>
+        <wanting>0</wanting>
+        <wishing>0</wishing>
+        <numcomments>0</numcomments>
+        <numweights>{rng.randint(0, 500)}</numweights>
+        <averageweight>{rng.uniform(1, 5):.4f}</averageweight>
+      </ratings>
+    </statistics>
+  </boardgame>
+'''
+
+
+def boardgames_xml(objectids, seed=0):
+    """
+    Render a response of the boardgame endpoint for one or more games
+
+    :param objectids: ids of the games
+    :param seed: seed for the random values
+    """
+    return ('<?xml version="1.0" encoding="utf-8"?>\n'
+            '<boardgames termsofuse="https://boardgamegeek.com/xmlapi/termsofuse">\n'
+            + ''.join(boardgame_element(objectid, seed) for objectid in objectids) + '</boardgames>\n')
+
+
+def write_merged_collection(path, size, seed=0):
+    """
+    Write a merged collection file like the one created by 1_fetch.py
+
+    :param path: path of the collection XML
+    :param size: number of games in the collection
+    :param seed: seed for the random values
+    """
+    listing = collection_xml(size, seed).split('\n')
+    with open(path, 'w', encoding='utf-8') as fp:
+        index = 0
+        for line in listing:
+            if line.strip() == '</item>':
+                fp.write(boardgame_element(game_id(index), seed))
+                index += 1
+            fp.write(line + '\n')
+
+
+def artwork(objectid, seed=0):
+    """
+    Render the box art of a game with shapes in random colors
+    Sizes and aspect ratios vary like the real images, some games are served as PNG
+
+    :param objectid: id of the game
+    :param seed: seed for the random values
+    :return: the encoded image and its content type
+    """
+    rng = random.Random(seed * 1000003 + game_index(objectid) + 7)
+    width = rng.choice([600, 900, 1200, 1600])
+    height = int(width * rng.choice([0.75, 1, 1.33, 0.56]))
+    image = Image.new('RGB', (width, height), tuple(rng.randint(0, 255) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(30):
+        x, y = rng.randint(0, width), rng.randint(0, height)
+        size = rng.randint(10, width // 3)
+        draw.ellipse((x, y, x + size, y + size), fill=tuple(rng.randint(0, 255) for _ in range(3)))
+    buffer = io.BytesIO()
+    if rng.random() < 0.2:
+        image.save(buffer, 'PNG')
+        return buffer.getvalue(), 'image/png'
+    image.save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue(), 'image/jpeg'
+
+
+def write_icons(directory, names):
+    """
+    Write simple stand-ins for the icons that are not included in the repository
+
+    :param directory: the resources directory
+    :param names: file names of the icons
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name in names:
+        icon = Image.new('RGBA', (240, 240), (0, 0, 0, 0))
+        ImageDraw.Draw(icon).ellipse((20, 20, 220, 220), fill=(0, 0, 0, 255))
+        icon.save(os.path.join(directory, name))
@@ -0,0 +1,105 @@
+"""
+Streaming reader and writer for the merged collection XML
+Items are processed one at a time, so memory use does not grow with the size of the collection
+"""
+import os
+import xml.etree.ElementTree as ET
+
+# Children of the boardgame element used by the selection and the CSV summary
+BOARDGAME_FIELDS = ('age', 'boardgamecategory', 'boardgamemechanic', 'poll', 'statistics')
+BOARDGAME_POLLS = ('suggested_numplayers',)
+
+
+def prune(item):
+    """
+    Remove the parts of a merged item that are not used, like descriptions, comments and versions
+
+    :param item: collection item with the boardgame data appended
+    :return: the same item
+    """
+    boardgame = item.find('boardgame')
+    if boardgame is not None:
+        for child in list(boardgame):
+            if child.tag not in BOARDGAME_FIELDS or (child.tag == 'poll'
+                                                     and child.get('name') not in BOARDGAME_POLLS):
+                boardgame.remove(child)
+    return item
+
+
+def iter_items(path, pruned=True):
+    """
+    Iterate over the items of a collection file without loading the whole document
+    Items are detached from the document once they are yielded
+
+    :param path: path of the collection XML
+    :param pruned: drop the parts of the items that are not used by the selection
+    :return: generator of item elements
+    """
+    context = ET.iterparse(path, events=('start', 'end'))
+    _, root = next(context)
+    depth = 0
+    for event, element in context:
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 0 and element.tag == 'item':
+            root.remove(element)
+            yield prune(element) if pruned else element
+
+
+def read_root_attributes(path):
+    """
+    Read the attributes of the root element of a collection file
+
+    :param path: path of the collection XML
+    """
+    for _, root in ET.iterparse(path, events=('start',)):
+        return dict(root.attrib)
+    return {}
+
+
+class CollectionWriter:
+    """
+    Write a collection file item by item
+    The file is written to a temporary path and only replaces the target once it is complete
+    """
+
+    def __init__(self, path, attributes=None):
+        """
+        :param path: path of the collection XML
+        :param attributes: attributes of the root items element
+        """
+        self.path = path
+        self.temp_path = f'{path}.tmp'
+        self.attributes = attributes or {}
+        self.fp = None
+        self.count = 0
+
+    def __enter__(self):
+        self.fp = open(self.temp_path, 'wb')
+        root = ET.Element('items', self.attributes)
+        root.text = '\n'
+        # Serialize an empty root and split it to get matching start and end tags
+        start_tag = ET.tostring(root, encoding='unicode').rsplit('</items>', 1)[0]
+        self.fp.write(b"<?xml version='1.0' encoding='UTF-8'?>\n")
+        self.fp.write(start_tag.encode('utf-8'))
+        return self
+
+    def write(self, item):
+        """
+        Append an item to the file
+
+        :param item: the item element
+        """
+        item.tail = '\n'
+        self.fp.write(ET.tostring(item, encoding='UTF-8', xml_declaration=False))
+        self.count += 1
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.fp.write(b'</items>')
+        self.fp.close()
+        if exc_type is None:
+            os.replace(self.temp_path, self.path)
+        else:
+            os.remove(self.temp_path)
@@ -0,0 +1,163 @@
+"""
+Compact records of the games in a collection
+The values are parsed once when the collection is loaded, so selecting games needs no XML lookups
+"""
+import os
+import pickle
+
+# Increase when the meaning of the stored values changes
+SNAPSHOT_VERSION = 3
+
+
+def parse_int(value):
+    """
+    Parse an integer, None if the value is missing or not a number
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_float(value):
+    """
+    Parse a float, None if the value is missing or not a number
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def text(element):
+    """
+    Text of an element, None if the element is missing
+    """
+    return element.text if element is not None else None
+
+
+def poll_index(poll):
+    """
+    Summarize the suggested_numplayers poll, a player count is best or recommended if more than half
+    of its votes say so
+
+    :param poll: tuples of player count and best, recommended and not recommended votes
+    :return: player counts voted best, player counts voted at least recommended
+        and the share of best votes by player count
+    """
+    best = []
+    recommended = []
+    best_share = {}
+    for numplayers, voted_best, voted_recommended, voted_not_recommended in poll:
+        total_votes = voted_best + voted_recommended + voted_not_recommended
+        best_share[numplayers] = voted_best / total_votes if total_votes else 0
+        if total_votes / 2 < voted_best:
+            best.append(numplayers)
+        if total_votes / 2 < voted_recommended + voted_best:
+            recommended.append(numplayers)
+    return tuple(best), tuple(recommended), best_share
+
+
+# Fields of a game holding numbers, they can be used in filters and scoring expressions
+NUMERIC_FIELDS = ('year', 'min_players', 'max_players', 'min_playtime', 'max_playtime', 'age', 'rank', 'average',
+                  'bayes_average', 'weight', 'owned', 'users_rated', 'numplays')
+
+
+class Game:
+    """
+    A game of the collection combining the collection item and the boardgame data
+    """
+    __slots__ = (
+        'id', 'name', 'image', 'year', 'min_players', 'max_players', 'min_playtime', 'max_playtime', 'age',
+        'rank', 'average', 'bayes_average', 'weight', 'owned', 'users_rated', 'user_rating', 'numplays',
+        'category_ids', 'categories', 'mechanics', 'poll', 'best_players', 'recommended_players', 'best_share',
+    )
+
+    def __init__(self, **values):
+        for field in self.__slots__:
+            setattr(self, field, values.get(field))
+
+    def __getstate__(self):
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def __setstate__(self, state):
+        for field, value in zip(self.__slots__, state):
+            setattr(self, field, value)
+
+    def __repr__(self):
+        return f'Game({self.id}, {self.name!r})'
+
+    @classmethod
+    def from_item(cls, item):
+        """
+        Create a game from a merged collection item
+
+        :param item: collection item with the boardgame data appended
+        """
+        stats = item.find('stats')
+        ratings = item.find('./boardgame/statistics/ratings')
+        rank = item.find('./boardgame/statistics/ratings/ranks/rank[@name="boardgame"]')
+        user_rating = item.find('./stats/rating')
+        poll = []
+        for results in item.findall('./boardgame/poll[@name="suggested_numplayers"]/results'):
+            votes = {result.get('value'): int(result.get('numvotes')) for result in results.findall('result')}
+            poll.append((results.get('numplayers'),
+                         votes.get('Best', 0), votes.get('Recommended', 0), votes.get('Not Recommended', 0)))
+        best_players, recommended_players, best_share = poll_index(poll)
+        return cls(
+            id=item.get('objectid'),
+            name=text(item.find('name')),
+            image=text(item.find('image')),
+            year=parse_int(text(item.find('yearpublished'))),
+            min_players=parse_int(stats.get('minplayers')) if stats is not None else None,
+            max_players=parse_int(stats.get('maxplayers')) if stats is not None else None,
+            min_playtime=parse_int(stats.get('minplaytime')) if stats is not None else None,
+            max_playtime=parse_int(stats.get('maxplaytime')) if stats is not None else None,
+            age=parse_int(text(item.find('./boardgame/age'))),
+            rank=parse_int(rank.get('value')) if rank is not None else None,
+            average=parse_float(text(ratings.find('average'))) if ratings is not None else None,
+            bayes_average=parse_float(text(ratings.find('bayesaverage'))) if ratings is not None else None,
+            weight=parse_float(text(ratings.find('averageweight'))) if ratings is not None else None,
+            owned=parse_int(text(ratings.find('owned'))) if ratings is not None else None,
+            users_rated=parse_int(text(ratings.find('usersrated'))) if ratings is not None else None,
+            user_rating=user_rating.get('value') if user_rating is not None else None,
+            numplays=parse_int(text(item.find('numplays'))),
+            category_ids=tuple(category.get('objectid')
+                               for category in item.findall('./boardgame/boardgamecategory')),
+            categories=tuple(category.text for category in item.findall('./boardgame/boardgamecategory')),
+            mechanics=tuple(mechanic.text for mechanic in item.findall('./boardgame/boardgamemechanic')),
+            poll=tuple(poll),
+            best_players=best_players,
+            recommended_players=recommended_players,
+            best_share=best_share,
+        )
+
+
+def write_snapshot(path, games):
+    """
+    Store the games as binary snapshot, which loads much faster than parsing the collection XML
+
+    :param path: path of the snapshot file
+    :param games: the games to store
+    """
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as fp:
+        pickle.dump((SNAPSHOT_VERSION, Game.__slots__, games), fp, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)
+
+
+def read_snapshot(path):
+    """
+    Load the games from a binary snapshot
+
+    :param path: path of the snapshot file
+    :return: the games, None if the snapshot is missing or was written by another version
+    """
+    try:
+        with open(path, 'rb') as fp:
+            version, fields, games = pickle.load(fp)
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError, AttributeError):
+        return None
+    if version != SNAPSHOT_VERSION or fields != Game.__slots__:
+        return None
+    return games
@@ -0,0 +1,237 @@
+"""
+Shared HTTP client used by the scripts
+Keeps connections alive in a pooled session and caches responses as files with validation metadata
+"""
+import json
+import os
+import threading
+from time import sleep, monotonic, time
+
+import metrics
+
+# Status codes BGG answers with while throttling or still preparing a response
+RETRY_STATUS_CODES = (202, 429, 503)
+COLLECTION_NOT_READY = 'Your request for this collection has been accepted and will be processed'
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter, shared between all fetch workers
+    """
+
+    def __init__(self, rate, capacity=1):
+        """
+        :param rate: tokens added per second
+        :param capacity: maximum number of tokens that can be used in a burst
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a token is available and consume it
+        """
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+
+def get_session(pool_size=10):
+    """
+    Get the session shared by all threads of the process
+    Connections are kept alive and reused for following requests to the same host
+
+    :param pool_size: number of connections kept per host, used when the session is created
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            # Imported on first use, scripts that only read the caches start without loading requests
+            import requests as req
+            from requests.adapters import HTTPAdapter
+
+            session = req.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
+
+def get(url, name, limiter=None, max_retries=0, retry_backoff=2, headers=None, stream=False):
+    """
+    Request an url with the shared session
+    Retries with exponential backoff while the server is throttling or still processing the request
+
+    :param url: url to load
+    :param name: name used in log messages
+    :param limiter: optional TokenBucket to respect before each request
+    :param max_retries: number of retries for throttled or not ready responses
+    :param retry_backoff: initial delay in seconds between retries, doubled on each retry
+    :param headers: additional request headers
+    :param stream: do not download the body immediately
+    :return: the successful or not modified response
+    """
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            with metrics.timer('http.rate_limit_wait'):
+                limiter.acquire()
+        print(f'Reading {name} from web')
+        with metrics.timer('http.request'):
+            response = get_session().get(url, headers=headers, stream=stream)
+        metrics.count(f'http.status.{response.status_code}')
+        not_ready = (response.status_code in RETRY_STATUS_CODES
+                     or (not stream and response.text.find(COLLECTION_NOT_READY) > 0))
+        if not not_ready:
+            if response.status_code != 304:
+                response.raise_for_status()
+            return response
+        # Release the connection to the pool, a streamed body is not read otherwise
+        response.close()
+        if attempt == max_retries:
+            break
+        # Prefer the delay requested by the server, otherwise back off exponentially
+        retry_after = response.headers.get('Retry-After', '')
+        delay = int(retry_after) if retry_after.isdigit() else min(retry_backoff * 2 ** attempt, 60)
+        print(f'{name} not ready yet (status {response.status_code}), waiting {delay} seconds')
+        metrics.count('http.retry')
+        sleep(delay)
+    raise RuntimeError(f'Giving up on {name} after {max_retries + 1} attempts')
+
+
+def read_meta(path):
+    """
+    Read the cache metadata stored next to a cached file
+    Files cached before metadata was recorded use their modification time as fetch time
+
+    :param path: path of the cached file
+    :return: dict with fetched_at, etag and last_modified, None if the file is not cached
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(f'{path}.meta', 'r', encoding='utf-8') as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {'fetched_at': os.path.getmtime(path), 'etag': None, 'last_modified': None}
+
+
+def write_meta(path, response=None, fetched_at=None):
+    """
+    Store the cache metadata of a cached file
+
+    :param path: path of the cached file
+    :param response: response the file was created from, used for the validators
+    :param fetched_at: time of the fetch, defaults to now
+    """
+    meta = read_meta(path) or {}
+    meta['fetched_at'] = fetched_at or time()
+    if response is not None:
+        meta['etag'] = response.headers.get('ETag')
+        meta['last_modified'] = response.headers.get('Last-Modified')
+    write_atomic(f'{path}.meta', json.dumps(meta).encode('utf-8'))
+
+
+def write_atomic(path, content):
+    """
+    Write a file so readers never see a partially written file
+
+    :param path: path of the file
+    :param content: bytes or an iterable of bytes chunks
+    """
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'wb') as fp:
+        if isinstance(content, bytes):
+            fp.write(content)
+        else:
+            for chunk in content:
+                fp.write(chunk)
+    os.replace(temp_path, path)
+
+
+def is_fresh(path, ttl_days):
+    """
+    Check if a cached file exists and is younger than the time to live
+
+    :param path: path of the cached file
+    :param ttl_days: time to live in days, None to keep cached files forever
+    """
+    return meta_is_fresh(read_meta(path), ttl_days)
+
+
+def meta_is_fresh(meta, ttl_days):
+    """
+    Check if cache metadata belongs to an entry younger than the time to live
+
+    :param meta: the cache metadata, None if the entry is not cached
+    :param ttl_days: time to live in days, None to keep cached entries forever
+    """
+    if meta is None:
+        return False
+    return ttl_days is None or time() - meta['fetched_at'] < ttl_days * 86400
+
+
+def meta_has_validators(meta):
+    """
+    Check if a cached entry can be revalidated with a conditional request
+
+    :param meta: the cache metadata, None if the entry is not cached
+    """
+    return meta is not None and bool(meta.get('etag') or meta.get('last_modified'))
+
+
+def conditional_headers(meta):
+    """
+    Get the headers of a conditional request revalidating a cached entry
+
+    :param meta: the cache metadata, None if the entry is not cached
+    """
+    headers = {}
+    if meta is not None:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+    return headers
+
+
+def fetch_cached(url, path, name, ttl_days=None, stream=False, **get_kwargs):
+    """
+    Make sure a fresh copy of an url is cached in a file
+    Stale files are revalidated with a conditional request and only downloaded again if changed
+
+    :param url: url to load
+    :param path: path of the cached file
+    :param name: name used in log messages
+    :param ttl_days: time to live in days, None to keep cached files forever
+    :param stream: write the body to the file in chunks instead of loading it at once
+    :param get_kwargs: additional arguments for get
+    :return: True if the content was downloaded, False if the cached file was still valid
+    """
+    if is_fresh(path, ttl_days):
+        metrics.count('cache.hit')
+        return False
+    response = get(url, name, headers=conditional_headers(read_meta(path)), stream=stream, **get_kwargs)
+    if response.status_code == 304:
+        print(f'{name} not modified')
+        metrics.count('cache.not_modified')
+        write_meta(path)
+        return False
+    metrics.count('cache.miss')
+    with metrics.timer('http.download'):
+        write_atomic(path, response.iter_content(chunk_size=65536) if stream else response.content)
+    write_meta(path, response)
+    return True
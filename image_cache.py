@@ -0,0 +1,144 @@
+"""
+Cache of resized game images
+Derived images are stored by the content hash of their source, the target size, dpi and resample filter,
+so a card is rendered from a small thumbnail instead of decoding the full image again
+"""
+import functools
+import hashlib
+import io
+import os
+
+from PIL import Image
+
+import metrics
+from http_client import write_atomic
+
+RESAMPLE_FILTERS = {
+    'nearest': Image.Resampling.NEAREST,
+    'bilinear': Image.Resampling.BILINEAR,
+    'bicubic': Image.Resampling.BICUBIC,
+    'lanczos': Image.Resampling.LANCZOS,
+}
+
+
+def source_hash(path):
+    """
+    Hash of the content of a source image, hashed once per process as long as the file is unchanged
+
+    :param path: path of the source image
+    """
+    stat = os.stat(path)
+    return _source_hash(path, stat.st_size, stat.st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=4096)
+def _source_hash(path, size, mtime_ns):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def derived_path(directory, name, content_hash, max_width, max_height, dpi, resample):
+    """
+    Get the path of a derived image
+
+    :param directory: directory of the derived images
+    :param name: name of the source, e.g. the game id
+    :param content_hash: hash of the source image
+    :param max_width: the maximum width of the derived image
+    :param max_height: the maximum height of the derived image
+    :param dpi: the dpi the image is rendered for
+    :param resample: name of the resample filter
+    """
+    return os.path.join(directory, f'{name}-{content_hash[:16]}-{max_width}x{max_height}-{dpi}-{resample}.png')
+
+
+def resize_image(image_path, max_width, max_height, resample='bicubic'):
+    """
+    Decode an image and resize it maintaining the aspect ratio
+    JPEG images are decoded at a reduced scale and other images are reduced by an integer factor first,
+    so the final resample only works on an image at most twice the target size
+
+    :param image_path: path of the image, the format is detected from the content
+    :param max_width: the maximum width after resize
+    :param max_height: the maximum height after resize
+    :param resample: name of the resample filter
+    :return: the resized image in RGB mode
+    """
+    img = Image.open(image_path)
+    width, height = img.size
+    ratio = min(max_width / width, max_height / height)
+    size = (max(1, int(width * ratio)), max(1, int(height * ratio)))
+    # Only has an effect on JPEG images, decodes directly at a scale of 1/2, 1/4 or 1/8
+    img.draft('RGB', (size[0] * 2, size[1] * 2))
+    img = img.convert('RGB')
+    factor = min(img.width // (size[0] * 2), img.height // (size[1] * 2))
+    if factor > 1:
+        img = img.reduce(factor)
+    return img.resize(size, RESAMPLE_FILTERS[resample])
+
+
+def load_derived_image(directory, name, image_path, max_width, max_height, dpi, resample='bicubic'):
+    """
+    Load a resized image from the cache, deriving it from the source image if required
+
+    :param directory: directory of the derived images
+    :param name: name of the source, e.g. the game id
+    :param image_path: path of the source image
+    :param max_width: the maximum width of the image
+    :param max_height: the maximum height of the image
+    :param dpi: the dpi the image is rendered for
+    :param resample: name of the resample filter
+    :return: the resized image in RGB mode
+    """
+    path = derived_path(directory, name, source_hash(image_path), max_width, max_height, dpi, resample)
+    try:
+        with metrics.timer('image.load_derived'), Image.open(path) as cached:
+            cached.load()
+        # Mark the image as recently used for the eviction
+        os.utime(path)
+        metrics.count('image_cache.hit')
+        return cached
+    except (OSError, ValueError):
+        pass
+    metrics.count('image_cache.miss')
+    with metrics.timer('image.decode_resize'):
+        img = resize_image(image_path, max_width, max_height, resample)
+    os.makedirs(directory, exist_ok=True)
+    buffer = io.BytesIO()
+    with metrics.timer('image.encode_derived'):
+        img.save(buffer, 'PNG', compress_level=1)
+    write_atomic(path, buffer.getvalue())
+    return img
+
+
+def evict(directory, budget_mb):
+    """
+    Remove the least recently used derived images until the directory fits into the budget
+
+    :param directory: directory of the derived images
+    :param budget_mb: size budget in megabytes, None to keep all images
+    :return: number of removed images
+    """
+    if budget_mb is None or not os.path.isdir(directory):
+        return 0
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.endswith('.png'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    budget = budget_mb * 1024 * 1024
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= budget:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
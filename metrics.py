@@ -0,0 +1,188 @@
+"""
+Timers and counters collected while the scripts run
+Metrics are kept per process, worker processes return a snapshot that is merged into the metrics of the parent
+"""
+import argparse
+import contextlib
+import cProfile
+import csv
+import json
+import threading
+from time import perf_counter
+
+_lock = threading.Lock()
+# Timers by name as [calls, seconds, max seconds of a call]
+_timers = {}
+_counters = {}
+
+
+def count(name, amount=1):
+    """
+    Increase a counter
+
+    :param name: name of the counter, e.g. cache.hit
+    :param amount: value added to the counter
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def add_time(name, seconds, calls=1):
+    """
+    Add a measured time to a timer
+
+    :param name: name of the timer, e.g. http.request
+    :param seconds: the measured time
+    :param calls: number of calls the time was measured for
+    """
+    with _lock:
+        timer_values = _timers.setdefault(name, [0, 0.0, 0.0])
+        timer_values[0] += calls
+        timer_values[1] += seconds
+        timer_values[2] = max(timer_values[2], seconds / calls if calls else seconds)
+
+
+@contextlib.contextmanager
+def timer(name):
+    """
+    Measure the time spent in a with block, the time is also added if the block raises
+
+    :param name: name of the timer
+    """
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        add_time(name, perf_counter() - start)
+
+
+def snapshot():
+    """
+    Get the current metrics of the process
+
+    :return: dict of timers with calls, seconds and max_seconds and of counters
+    """
+    with _lock:
+        return {
+            'timers': {name: {'calls': calls, 'seconds': seconds, 'max_seconds': max_seconds}
+                       for name, (calls, seconds, max_seconds) in sorted(_timers.items())},
+            'counters': dict(sorted(_counters.items())),
+        }
+
+
+def since(previous):
+    """
+    Get the metrics added since an earlier snapshot of the process
+
+    :param previous: the earlier snapshot
+    :return: snapshot of the added metrics, max_seconds is the longest call of the process so far
+    """
+    current = snapshot()
+    timers = {}
+    for name, timer_values in current['timers'].items():
+        old = previous['timers'].get(name, {'calls': 0, 'seconds': 0.0})
+        if timer_values['calls'] != old['calls']:
+            timers[name] = {'calls': timer_values['calls'] - old['calls'],
+                            'seconds': timer_values['seconds'] - old['seconds'],
+                            'max_seconds': timer_values['max_seconds']}
+    counters = {name: value - previous['counters'].get(name, 0) for name, value in current['counters'].items()
+                if value != previous['counters'].get(name, 0)}
+    return {'timers': timers, 'counters': counters}
+
+
+def merge(values):
+    """
+    Add the metrics of another process
+
+    :param values: a snapshot of the other process
+    """
+    with _lock:
+        for name, timer_values in values['timers'].items():
+            own = _timers.setdefault(name, [0, 0.0, 0.0])
+            own[0] += timer_values['calls']
+            own[1] += timer_values['seconds']
+            own[2] = max(own[2], timer_values['max_seconds'])
+        for name, value in values['counters'].items():
+            _counters[name] = _counters.get(name, 0) + value
+
+
+def reset():
+    """
+    Remove all metrics of the process
+    """
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+
+def write_report(path_prefix, wall_seconds):
+    """
+    Write the metrics as JSON and CSV report
+
+    :param path_prefix: path of the reports without extension
+    :param wall_seconds: total run time of the script
+    """
+    values = snapshot()
+    with open(f'{path_prefix}.json', 'w', encoding='utf-8') as fp:
+        json.dump({'wall_seconds': wall_seconds, **values}, fp, indent=2)
+    with open(f'{path_prefix}.csv', 'w', encoding='utf-8', newline='') as fp:
+        writer = csv.writer(fp)
+        writer.writerow(['kind', 'name', 'calls', 'seconds', 'max_seconds', 'value'])
+        writer.writerow(['timer', 'wall', 1, round(wall_seconds, 6), round(wall_seconds, 6), ''])
+        for name, timer_values in values['timers'].items():
+            writer.writerow(['timer', name, timer_values['calls'], round(timer_values['seconds'], 6),
+                             round(timer_values['max_seconds'], 6), ''])
+        for name, value in values['counters'].items():
+            writer.writerow(['counter', name, '', '', '', value])
+
+
+def print_summary(wall_seconds):
+    """
+    Print the metrics of the process
+
+    :param wall_seconds: total run time of the script
+    """
+    values = snapshot()
+    print(f'\n{"timer":<32} {"calls":>8} {"seconds":>10} {"max":>10}')
+    print(f'{"wall":<32} {1:>8} {wall_seconds:>10.3f} {wall_seconds:>10.3f}')
+    for name, timer_values in values['timers'].items():
+        print(f'{name:<32} {timer_values["calls"]:>8} {timer_values["seconds"]:>10.3f} '
+              f'{timer_values["max_seconds"]:>10.3f}')
+    for name, value in values['counters'].items():
+        print(f'{name:<32} {value:>8}')
+
+
+def run_main(function, description, add_arguments=None):
+    """
+    Run the main function of a script with the --profile and --cprofile options
+
+    :param function: the main function of the script
+    :param description: description of the script shown in the help
+    :param add_arguments: function adding the arguments of the script to the parser,
+        the main function is then called with the parsed arguments
+    :return: the result of the function
+    """
+    parser = argparse.ArgumentParser(description=description)
+    if add_arguments is not None:
+        add_arguments(parser)
+    parser.add_argument('--profile', metavar='PATH',
+                        help='print the collected metrics and write them to PATH.json and PATH.csv')
+    parser.add_argument('--cprofile', action='store_true',
+                        help='also write a cProfile dump of the main process to PATH.prof, e.g. for snakeviz '
+                             'or flameprof')
+    args = parser.parse_args()
+    profiler = cProfile.Profile() if args.profile and args.cprofile else None
+    start = perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        return function(args) if add_arguments is not None else function()
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(f'{args.profile}.prof')
+        if args.profile:
+            wall_seconds = perf_counter() - start
+            print_summary(wall_seconds)
+            write_report(args.profile, wall_seconds)
+            print(f'\nMetrics written to {args.profile}.json and {args.profile}.csv')
@@ -0,0 +1,111 @@
+"""
+Run any of the stages fetch, select, generate and export in one process
+
+The games and the selection are passed between the stages in memory instead of being read back from
+collection.xml and selection.yaml. The stage scripts are only imported when their stage runs, so a select
+run starts without loading Pillow or requests. Stages that are not run read the outputs of earlier runs.
+"""
+import argparse
+import importlib
+import os
+from time import perf_counter
+
+import metrics
+from settings import config, load_config, use_config
+
+STAGES = ['fetch', 'select', 'generate', 'export']
+
+
+class Pipeline:
+    """
+    Results of the stages run so far, used by the following stages
+    """
+
+    def __init__(self, checkpoint=False):
+        """
+        :param checkpoint: write the selection file, so single stages can be run again later
+        """
+        self.checkpoint = checkpoint
+        self.games = None
+        self.groups = None
+        self.cards = None
+
+    def run_stage(self, stage):
+        """
+        Run a stage with the results of the previous stages
+
+        :param stage: name of the stage
+        :return: list of failed items, empty if the stage succeeded
+        """
+        return getattr(self, stage)() or []
+
+    def fetch(self):
+        self.games = importlib.import_module('1_fetch').get_collection()
+
+    def select(self):
+        self.groups = importlib.import_module('2_select').select_collection(self.games, write=self.checkpoint)
+        self.cards = None
+
+    def generate(self):
+        generate = importlib.import_module('3_generate')
+        return generate.generate_cards(self.card_selection(generate))
+
+    def export(self):
+        export = importlib.import_module('4_export')
+        return export.export_cards(self.card_selection(export.generate))
+
+    def card_selection(self, generate):
+        """
+        Get the cards of the selected groups, None if the selection file has to be read
+        """
+        if self.cards is None and self.groups is not None:
+            self.cards = generate.selection_cards(self.groups)
+        return self.cards
+
+
+def stage_name(value):
+    """
+    Check a stage given on the command line
+    """
+    if value not in STAGES:
+        raise argparse.ArgumentTypeError(f'invalid stage {value!r}, choose from {", ".join(STAGES)}')
+    return value
+
+
+def add_arguments(parser):
+    # The stages are checked by their type, argparse checks an empty list of optional positionals against the
+    # choices and rejects it
+    parser.add_argument('stages', nargs='*', type=stage_name, metavar='{' + ','.join(STAGES) + '}',
+                        help='stages to run, defaults to all, they always run in the order ' + ', '.join(STAGES))
+    parser.add_argument('--config', help='config file to use instead of config.yaml')
+    parser.add_argument('--checkpoint', action='store_true',
+                        help='also write the selection file, e.g. to run 3_generate.py on its own later')
+
+
+def run(args):
+    """
+    Run the requested stages and print the time of each
+
+    :param args: the parsed arguments
+    :return: list of failed items of the first failing stage
+    """
+    if args.config:
+        use_config(load_config(args.config))
+    os.makedirs(config['general']['cache_directory'], exist_ok=True)
+    pipeline = Pipeline(checkpoint=args.checkpoint)
+    stages = args.stages or STAGES
+    for stage in STAGES:
+        if stage not in stages:
+            continue
+        print(f'\n== {stage} ==')
+        start = perf_counter()
+        failed = pipeline.run_stage(stage)
+        print(f'{stage} finished in {perf_counter() - start:.2f}s')
+        if failed:
+            print(f'Stopping after {stage}, {len(failed)} failed')
+            return failed
+    return []
+
+
+if __name__ == '__main__':
+    exit(1 if metrics.run_main(run, 'Run the stages of the pipeline in one process', add_arguments) else 0)
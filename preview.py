@@ -0,0 +1,213 @@
+"""
+Live preview of the cards while working on the layout
+
+The cards are rendered as low resolution proofs and served as a contact sheet on a local HTTP server.
+The config, the selection and the resources are watched, and only the cards whose inputs changed are
+rendered again. The page reloads itself after each render. Run 3_generate.py for the full quality cards.
+"""
+import argparse
+import functools
+import html
+import importlib
+import os
+import threading
+import traceback
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter, sleep
+
+from settings import CONFIG_FILE, config, load_config, merge_config, use_config
+
+PAGE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>bgg-quartets preview</title>
+<style>
+body {{ font-family: sans-serif; background: #333; color: #eee; margin: 1em; }}
+.cards {{ display: flex; flex-wrap: wrap; gap: 8px; }}
+figure {{ margin: 0; text-align: center; font-size: 12px; }}
+img {{ height: {height}px; display: block; }}
+.failed {{ color: #f66; }}
+</style>
+</head>
+<body>
+<p>Version {version}, {count} cards, updated in {seconds:.2f}s</p>
+{failed}
+<div class="cards">
+{cards}
+</div>
+<script>
+setInterval(() => fetch('/version').then(r => r.text()).then(v => {{ if (v !== '{version}') location.reload(); }}), 500);
+</script>
+</body>
+</html>
+'''
+
+
+class Preview:
+    """
+    State of the preview shared between the render loop and the server
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.cards = []
+        self.failed = []
+        self.seconds = 0.0
+        self.lock = threading.Lock()
+
+    def page(self, height):
+        """
+        Get the contact sheet of the last render
+
+        :param height: height of the cards on the page in pixel
+        """
+        with self.lock:
+            cards = '\n'.join(f'<figure><img src="{html.escape(file_name)}?v={version}" alt="">'
+                              f'<figcaption>{html.escape(name)}</figcaption></figure>'
+                              for name, file_name, version in self.cards)
+            failed = (f'<p class="failed">Failed: {html.escape(", ".join(self.failed))}</p>'
+                      if self.failed else '')
+            return PAGE.format(height=height, version=self.version, count=len(self.cards),
+                               seconds=self.seconds, failed=failed, cards=cards)
+
+
+def preview_config(base_config):
+    """
+    Build the config rendering proofs into the preview directory
+
+    :param base_config: the config loaded from the config file
+    """
+    preview = base_config.get('preview') or {}
+    return merge_config(base_config, {
+        'generate': {
+            'dpi': preview.get('dpi', 100),
+            'cards_directory': os.path.join(base_config['general']['cache_directory'], 'preview'),
+            'incremental': True,
+            'output_format': 'jpeg',
+            'jpeg_quality': 85,
+            'image_resample': preview.get('image_resample', 'bilinear'),
+            'save_workers': None,
+        },
+    })
+
+
+def watched_files():
+    """
+    Get the modification times of the config, the selection and all resources
+
+    :return: modification time by path, None for missing files
+    """
+    paths = [CONFIG_FILE, os.path.join(config['general']['cache_directory'], config['general']['selection_file_key'])]
+    for directory, _, file_names in os.walk('resources'):
+        paths += [os.path.join(directory, file_name) for file_name in file_names]
+    state = {}
+    for path in paths:
+        try:
+            state[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            state[path] = None
+    return state
+
+
+def render(preview):
+    """
+    Render the changed cards with the current config files and publish the result to the server
+
+    :param preview: the shared preview state
+    """
+    generate = importlib.import_module('3_generate')
+    start = perf_counter()
+    try:
+        # A config that cannot be loaded while it is edited keeps the last one
+        use_config(preview_config(load_config()))
+        failed = generate.generate_cards()
+    except Exception:
+        traceback.print_exc()
+        failed = ['all cards']
+    seconds = perf_counter() - start
+    selection_file_path = os.path.join(config['general']['cache_directory'], config['general']['selection_file_key'])
+    manifest = generate.load_render_manifest()
+    cards = []
+    if os.path.exists(selection_file_path):
+        for card_data in generate.get_selection(selection_file_path):
+            file_name = generate.card_file_name(card_data)
+            cards.append((f'{card_data["group"]}{card_data["index"]} {card_data["name"]}', file_name,
+                          manifest.get(file_name, '')[:12]))
+    with preview.lock:
+        preview.version += 1
+        preview.cards = cards
+        preview.failed = failed
+        preview.seconds = seconds
+    print(f'Preview version {preview.version} ready in {seconds:.2f}s')
+
+
+def serve(preview, port):
+    """
+    Serve the contact sheet and the rendered proofs in a background thread
+
+    :param preview: the shared preview state
+    :param port: port on localhost
+    :return: the server
+    """
+    directory = os.path.abspath(config['generate']['cards_directory'])
+    height = 300
+
+    class Handler(SimpleHTTPRequestHandler):
+        def do_GET(self):
+            if self.path in ('/', '/index.html'):
+                self.respond(preview.page(height).encode('utf-8'), 'text/html; charset=utf-8')
+            elif self.path == '/version':
+                self.respond(str(preview.version).encode('utf-8'), 'text/plain')
+            else:
+                super().do_GET()
+
+        def respond(self, body, content_type):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Cache-Control', 'no-store')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('localhost', port), functools.partial(Handler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f'Serving the preview on http://localhost:{port}/')
+    return server
+
+
+def run(port=None, interval=None):
+    """
+    Render the proofs and keep them up to date until interrupted
+
+    :param port: port of the server, defaults to the preview config
+    :param interval: seconds between checks for changed files, defaults to the preview config
+    """
+    preview = Preview()
+    render(preview)
+    preview_settings = config.get('preview') or {}
+    server = serve(preview, port or preview_settings.get('port', 8000))
+    interval = interval or preview_settings.get('interval', 0.5)
+    state = watched_files()
+    try:
+        while True:
+            sleep(interval)
+            current = watched_files()
+            if current != state:
+                changed = [path for path in current.keys() | state.keys() if current.get(path) != state.get(path)]
+                print(f'Changed: {", ".join(sorted(changed))}')
+                state = current
+                render(preview)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve low resolution proofs of the cards and update them live')
+    parser.add_argument('--port', type=int, help='port of the preview server')
+    parser.add_argument('--interval', type=float, help='seconds between checks for changed files')
+    args = parser.parse_args()
+    run(args.port, args.interval)
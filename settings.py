@@ -0,0 +1,51 @@
+"""
+Configuration shared by the scripts
+All scripts use the same config object, so replacing its values affects every script of the process
+"""
+import copy
+import os
+
+from ruamel import yaml
+
+CONFIG_FILE = 'config.yaml'
+
+
+def load_config(path=CONFIG_FILE):
+    """
+    Load a config file
+
+    :param path: path of the yaml file
+    """
+    with open(path, 'r', encoding='utf-8') as fp:
+        return yaml.safe_load(fp)
+
+
+def merge_config(base, overrides):
+    """
+    Merge overrides into a copy of a config, nested sections are merged key by key
+
+    :param base: the config to start from
+    :param overrides: values replacing those of the base config
+    :return: the merged config
+    """
+    merged = copy.deepcopy(base)
+    for key, value in (overrides or {}).items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_config(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+
+def use_config(values):
+    """
+    Replace the values of the shared config
+
+    :param values: the new config
+    """
+    config.clear()
+    config.update(values)
+
+
+# Scripts given another config file replace the values with use_config
+config = load_config() if os.path.exists(CONFIG_FILE) else {}
@@ -0,0 +1,9 @@
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The scripts and the helpers of the benchmarks are imported by the tests
+for path in (REPO_ROOT, os.path.join(REPO_ROOT, 'benchmarks')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,99 @@
+"""
+Incremental fetch against the local stand-in API
+"""
+import contextlib
+import copy
+import io
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import synthetic
+from common import load_script, sample_config
+from stub_server import StubApi, start_server
+
+SIZE = 10
+
+
+def listing(items):
+    """
+    Render a collection listing of the given items
+    """
+    root = ET.Element('items', totalitems=str(len(items)))
+    root.extend(items)
+    return ET.tostring(root, encoding='unicode')
+
+
+@pytest.fixture
+def stub():
+    api = StubApi(SIZE, latency=0, collection_delay=0)
+    server = start_server(api)
+    yield api, server
+    server.shutdown()
+
+
+@pytest.fixture
+def items():
+    """
+    Items of a synthetic listing with a second copy of the first game
+    """
+    items = ET.fromstring(synthetic.collection_xml(SIZE)).findall('item')
+    second_copy = copy.deepcopy(items[0])
+    second_copy.set('collid', str(SIZE + 1))
+    return items + [second_copy]
+
+
+@pytest.fixture
+def fetch(stub, tmp_path, monkeypatch):
+    _, server = stub
+    monkeypatch.chdir(tmp_path)
+    config = sample_config(fetch={'user': 'test', 'api_url': server.api_url, 'incremental': True,
+                                  'requests_per_second': 1000, 'retry_backoff': 0.01})
+    return load_script('1_fetch', str(tmp_path / 'work'), config)
+
+
+def get_collection(fetch, api, items):
+    api.collection = listing(items)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fetch.get_collection()
+
+
+def set_numplays(item, numplays):
+    item.find('numplays').text = str(numplays)
+
+
+def test_unchanged_collection_is_kept(stub, fetch, items):
+    api, _ = stub
+    assert len(get_collection(fetch, api, items)) == SIZE + 1
+    assert get_collection(fetch, api, items) is None
+
+
+def test_change_of_one_copy_is_detected(stub, fetch, items):
+    api, _ = stub
+    get_collection(fetch, api, items)
+    games_served = api.games_served
+    set_numplays(items[0], 100)
+    records = get_collection(fetch, api, items)
+    assert [record.numplays for record in records if record.id == items[0].get('objectid')] == \
+        [100, int(items[-1].findtext('numplays'))]
+    assert api.games_served == games_served
+
+
+def test_change_of_both_copies(stub, fetch, items):
+    api, _ = stub
+    get_collection(fetch, api, items)
+    set_numplays(items[0], 100)
+    set_numplays(items[-1], 200)
+    records = get_collection(fetch, api, items)
+    assert [record.numplays for record in records if record.id == items[0].get('objectid')] == [100, 200]
+
+
+def test_copies_are_added_and_removed(stub, fetch, items):
+    api, _ = stub
+    get_collection(fetch, api, items[:-1])
+    records = get_collection(fetch, api, items)
+    assert len(records) == SIZE + 1
+    assert [record.id for record in records].count(items[0].get('objectid')) == 2
+    records = get_collection(fetch, api, items[1:])
+    assert len(records) == SIZE
+    assert [record.id for record in records].count(items[0].get('objectid')) == 1
@@ -0,0 +1,70 @@
+"""
+Selection of the sets compared to the full sort it replaced
+"""
+import random
+
+import pytest
+
+from common import load_script, sample_config
+from game_store import Game, poll_index
+
+SIZE = 60
+
+
+@pytest.fixture
+def select(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    select = load_script('2_select', str(tmp_path / 'work'), sample_config(select={'replace_names': {}}))
+    return select
+
+
+def make_game(index, rng):
+    """
+    Create a game with few distinct values, so many games share a score
+    """
+    min_players = rng.choice([1, 2])
+    max_players = rng.choice([2, 4])
+    poll = tuple((str(players), rng.choice([0, 10]), rng.choice([0, 10]), 10)
+                 for players in range(1, max_players + 1))
+    best_players, recommended_players, best_share = poll_index(poll)
+    return Game(id=str(1000 + index), name=f'Game {index}', year=2000, min_players=min_players,
+                max_players=max_players, min_playtime=30, max_playtime=60, age=10,
+                # Every third game is not ranked, the others share a few ranks
+                rank=None if index % 3 == 0 else rng.choice([1, 2, 3]), average=rng.choice([6.0, 7.0]),
+                weight=2.0, owned=100, user_rating='N/A', numplays=rng.choice([0, 1]), category_ids=(),
+                categories=(), mechanics=(), poll=poll, best_players=best_players,
+                recommended_players=recommended_players, best_share=best_share)
+
+
+def sorted_selection(criteria, games, number_of_cards):
+    """
+    Selection as done before, fully sorting the games and removing the selected ones from the list
+    """
+    selected = sorted(games, key=criteria)[:number_of_cards]
+    for game in selected:
+        games.remove(game)
+    return [game.id for game in selected]
+
+
+@pytest.mark.parametrize('number_of_cards', [1, 13, 25])
+def test_select_games_matches_sort(select, number_of_cards):
+    rng = random.Random(number_of_cards)
+    games = [make_game(index, rng) for index in range(SIZE)]
+    criteria = [select.by_rank, select.by_best_for_two, select.by_best_for_many, select.by_user_played_often,
+                select.by_rank]
+    remaining = list(games)
+    expected = [sorted_selection(criterion, remaining, number_of_cards) for criterion in criteria]
+    selected_ids = set()
+    actual = [[entry['_id'] for entry in select.select_games(criterion, games, number_of_cards, selected_ids)]
+              for criterion in criteria]
+    assert actual == expected
+
+
+def test_unranked_games_keep_collection_order(select):
+    rng = random.Random(0)
+    games = [make_game(index, rng) for index in range(SIZE)]
+    unranked = [game.id for game in games if game.rank is None]
+    ranked = len(games) - len(unranked)
+    selected_ids = set()
+    select.select_games(select.by_rank, games, ranked, selected_ids)
+    assert [entry['_id'] for entry in select.select_games(select.by_rank, games, SIZE, selected_ids)] == unranked